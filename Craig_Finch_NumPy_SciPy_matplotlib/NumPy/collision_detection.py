@@ -37,3 +37,18 @@ collision_indices = zip(collisions[0], collisions[1])
 print(os.linesep + "Indices of spheres that overlap (as a list of tuples):")
 print(collision_indices)
 
+# Same query on condensed storage, which holds each pair once and takes half
+# the memory of the full matrix
+d_condensed = find_distances_5(x, y, z, radius, condensed=True)
+print(os.linesep + "Condensed distances between spheres:")
+print(d_condensed)
+
+collisions = condensed_where(d_condensed < 0.0)
+print(os.linesep + "Indices of spheres that overlap (from condensed distances):")
+print(collisions)
+
+# Stream overlapping pairs one block of rows at a time, without storing any
+# distance matrix
+print(os.linesep + "Overlapping spheres, streamed in blocks of 2 rows:")
+for batch in iter_overlaps(x, y, z, radius, chunk=2):
+    print(batch)
@@ -0,0 +1,127 @@
+"""Incremental collision detection for time-stepped simulations.
+
+collision_detection.py recomputes every distance each time it is called.
+When only a few spheres move per step, most of that work is repeated. The
+CollisionTracker class keeps the current overlaps and only rechecks spheres
+that have moved.
+"""
+
+import numpy as np
+from distance import (find_neighbors, _box_lengths, _periodic_delta,
+    _radius_sum, _ramp)
+
+class CollisionTracker(object):
+    """Track which spheres overlap as some of them move.
+
+    A Verlet neighbor list holds every pair of spheres within a "skin"
+    distance of touching. Until some sphere has moved more than half the skin
+    since the list was built, only pairs on the list can overlap, so an
+    update only compares the moved spheres with their listed neighbors. The
+    cost per step is O(moved x neighbors) instead of O(N^2). The list is
+    rebuilt automatically when a sphere moves too far.
+    """
+
+    def __init__(self, x, y, z, radius, skin=None, box=None):
+        """Build the neighbor list and find the initial overlaps.
+
+        Args:
+            x: NumPy array of particle x coordinates
+            y: NumPy array of particle y coordinates
+            z: NumPy array of particle z coordinates
+            radius: particle radius, or NumPy array with one radius per
+                particle
+            skin: extra edge-edge distance covered by the neighbor list.
+                Larger values mean fewer rebuilds but more neighbors to check
+                per update. Defaults to the (largest) radius.
+            box: optional side length of a periodic domain, as a float or
+                (Lx, Ly, Lz), for minimum image distances
+        """
+        assert len(x) == len(y) == len(z)  # primitive input validation
+
+        self.x = np.array(x, dtype=float)
+        self.y = np.array(y, dtype=float)
+        self.z = np.array(z, dtype=float)
+        self.radius = np.array(radius, dtype=float) if np.ndim(radius) \
+            else radius
+        self.skin = np.max(radius) if skin is None else skin
+        self.box = box
+        self.rebuilds = 0  # number of times the neighbor list was built
+        self.rebuild()
+
+    def rebuild(self):
+        """Rebuild the neighbor list and overlap set from current positions."""
+        n = len(self.x)
+        i, j, d = find_neighbors(self.x, self.y, self.z, self.radius,
+            self.skin, box=self.box)
+
+        # Neighbor list in CSR form: the neighbors of sphere k are
+        # self._neighbors[self._start[k]:self._start[k + 1]]
+        rows = np.concatenate((i, j))
+        order = np.argsort(rows, kind='mergesort')
+        self._neighbors = np.concatenate((j, i))[order]
+        self._start = np.concatenate(([0],
+            np.cumsum(np.bincount(rows, minlength=n))))
+
+        # Positions when the list was built, to measure displacement
+        self._x0, self._y0, self._z0 = (self.x.copy(), self.y.copy(),
+            self.z.copy())
+
+        # Map each overlapping sphere to the set of spheres it overlaps
+        self._touching = {}
+        for a, b in zip(i[d < 0.0].tolist(), j[d < 0.0].tolist()):
+            self._touching.setdefault(a, set()).add(b)
+            self._touching.setdefault(b, set()).add(a)
+
+        self.rebuilds += 1
+
+    def update(self, indices, new_x, new_y, new_z):
+        """Move some spheres and update the overlaps they are involved in.
+
+        Args:
+            indices: integer array of spheres that moved
+            new_x: NumPy array of new x coordinates of those spheres
+            new_y: NumPy array of new y coordinates of those spheres
+            new_z: NumPy array of new z coordinates of those spheres
+        """
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.intp))
+        self.x[indices] = new_x
+        self.y[indices] = new_y
+        self.z[indices] = new_z
+
+        # The list only holds every possible overlap while no sphere has
+        # moved more than half the skin since it was built
+        lx, ly, lz = _box_lengths(self.box)
+        moved = np.sqrt(
+            _periodic_delta(self.x[indices], self._x0[indices], lx)**2 \
+            + _periodic_delta(self.y[indices], self._y0[indices], ly)**2 \
+            + _periodic_delta(self.z[indices], self._z0[indices], lz)**2)
+        if np.any(moved > 0.5 * self.skin):
+            self.rebuild()
+            return
+
+        # Forget old overlaps involving the moved spheres
+        for a in indices.tolist():
+            for b in self._touching.pop(a, ()):
+                partners = self._touching.get(b)
+                if partners is not None:
+                    partners.discard(a)
+                    if not partners:
+                        del self._touching[b]
+
+        # Check moved spheres against their listed neighbors only
+        first = self._start[indices]
+        counts = self._start[indices + 1] - first
+        a = np.repeat(indices, counts)
+        b = self._neighbors[np.repeat(first, counts) + _ramp(counts)]
+        d = np.sqrt(_periodic_delta(self.x[a], self.x[b], lx)**2 \
+            + _periodic_delta(self.y[a], self.y[b], ly)**2 \
+            + _periodic_delta(self.z[a], self.z[b], lz)**2) \
+            - _radius_sum(self.radius, a, b)
+        for a, b in zip(a[d < 0.0].tolist(), b[d < 0.0].tolist()):
+            self._touching.setdefault(a, set()).add(b)
+            self._touching.setdefault(b, set()).add(a)
+
+    def overlaps(self):
+        """Return overlapping spheres as a sorted list of (i, j) with i > j."""
+        return sorted((a, b) for a, partners in self._touching.items()
+            for b in partners if a > b)
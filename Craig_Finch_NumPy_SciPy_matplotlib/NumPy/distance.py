@@ -4,19 +4,31 @@ The purpose of these functions is to illustrate the effect of various
 performance optimizations for numerical Python code.
 """
 
+import weakref
+
 import numpy as np
 
 def timer(func):
-    """Decorator to calculate the run time of a function."""
+    """Decorator to record the run time of a function.
+
+    Each call is timed with time.perf_counter_ns and recorded in
+    metrics.registry under the function's name. After metrics.disable(),
+    calls only pay for checking a flag. See metrics.py to export the results.
+    """
     from functools import wraps
     import time
+    import metrics
+
+    name = func.__name__
 
     @wraps(func)  # allows PyDoc to find docstrings of decorated functions
     def st_func(*args, **keyArgs):
-        t1 = time.time()
+        if not metrics.enabled:
+            return func(*args, **keyArgs)
+        t1 = time.perf_counter_ns()
         r = func(*args, **keyArgs)
-        t2 = time.time()
-        print("Function={}, Time={} sec".format(func.__name__, t2 - t1))
+        t2 = time.perf_counter_ns()
+        metrics.registry.record(name, t2 - t1)
         return r
 
     return st_func
@@ -47,25 +59,42 @@ def find_distances_1(x, y, z, radius):
     return d
 
 @timer
-def find_distances_2(x, y, z, radius):
+def find_distances_2(x, y, z, radius, condensed=False):
     """Find distances between all particles. Less naive implementation.
 
     Args:
         x: NumPy array of particle x coordinates
         y: NumPy array of particle y coordinates
         z: NumPy array of particle z coordinates
+        radius: particle radius, the same for every particle
+        condensed: if True, return only the distances between distinct
+            pairs as a 1D array, in the layout used by
+            scipy.spatial.distance.squareform. See condensed_index.
 
     Returns:
-        2D NumPy array of center-center distances
+        2D NumPy array of center-center distances, or 1D if condensed
     """
     assert len(x) == len(y) == len(z)  # primitive input validation
+    assert np.ndim(radius) == 0, \
+        "one radius for all particles; find_distances_5 takes one per particle"
+
+    if condensed:
+        n = len(x)
+        d = np.zeros(n * (n - 1) // 2)
+        k = 0
+        for i in range(n):
+            for j in range(i + 1, n):
+                d[k] = np.sqrt( (x[i] - x[j])**2 + (y[i] - y[j])**2 \
+                    + (z[i] - z[j])**2 ) - 2 * radius
+                k += 1
+        return d
 
     d = np.zeros((len(x), len(x)))  # center-center distances
 
     # Remove "if" from inner loop and eliminate redundant calculations
     for i in range(len(x)):
         for j in range(i):
-	    d[i, j] = np.sqrt( (x[i] - x[j])**2 + (y[i] - y[j])**2 \
+            d[i, j] = np.sqrt( (x[i] - x[j])**2 + (y[i] - y[j])**2 \
                 + (z[i] - z[j])**2 ) - 2 * radius
     return d
 
@@ -77,11 +106,14 @@ def find_distances_3(x, y, z, radius):
         x: NumPy array of particle x coordinates
         y: NumPy array of particle y coordinates
         z: NumPy array of particle z coordinates
+        radius: particle radius, the same for every particle
 
     Returns:
         2D NumPy array of center-center distances
     """
     assert len(x) == len(y) == len(z)  # primitive input validation
+    assert np.ndim(radius) == 0, \
+        "one radius for all particles; find_distances_5 takes one per particle"
 
     d = np.zeros((len(x), len(x)))  # center-center distances
 
@@ -98,11 +130,14 @@ def find_distances_4(x, y, z, radius):
         x: NumPy array of particle x coordinates
         y: NumPy array of particle y coordinates
         z: NumPy array of particle z coordinates
+        radius: particle radius, the same for every particle
 
     Returns:
         2D NumPy array of center-center distances
     """
     assert len(x) == len(y) == len(z)  # primitive input validation
+    assert np.ndim(radius) == 0, \
+        "one radius for all particles; find_distances_5 takes one per particle"
 
     d = np.zeros((len(x), len(x)))  # center-center distances
 
@@ -112,40 +147,86 @@ def find_distances_4(x, y, z, radius):
     return np.sqrt(d) - 2 * radius
 
 @timer
-def find_distances_5(x, y, z, radius):
+def find_distances_5(x, y, z, radius, condensed=False, box=None):
     """Find distances between all particles. Vectorized implementation 3.
 
     Args:
         x: NumPy array of particle x coordinates
         y: NumPy array of particle y coordinates
         z: NumPy array of particle z coordinates
+        radius: particle radius, or NumPy array with one radius per
+            particle
+        condensed: if True, return only the distances between distinct
+            pairs as a 1D array, in the layout used by
+            scipy.spatial.distance.squareform. See condensed_index.
+        box: optional side length of a periodic domain, as a float or
+            (Lx, Ly, Lz). Distances then follow the minimum image
+            convention, so no ghost copies of particles are needed.
 
     Returns:
-        2D NumPy array of center-center distances
+        2D NumPy array of center-center distances, or 1D if condensed
     """
     assert len(x) == len(y) == len(z)  # primitive input validation
 
+    lx, ly, lz = _box_lengths(box)
+    radius = _as_radius(radius)
+
+    if condensed:
+        # Row i of the upper triangle is stored contiguously, so each
+        # vectorized row fills one slice
+        n = len(x)
+        d = np.zeros(n * (n - 1) // 2)
+        start = 0
+        for i in range(n - 1):
+            stop = start + n - i - 1
+            d[start:stop] = np.sqrt(_periodic_delta(x[i], x[i+1:], lx)**2 \
+                + _periodic_delta(y[i], y[i+1:], ly)**2 \
+                + _periodic_delta(z[i], z[i+1:], lz)**2) \
+                - _radius_sum(radius, i, slice(i + 1, None))
+            start = stop
+        return d
+
     d = np.zeros((len(x), len(x)))  # center-center distances
 
     # Eliminating redundant calculations from vectorized inner loop
     for i in range(len(x)):
-        d[i, :i] = np.sqrt((x[i] - x[:i])**2 + (y[i] - y[:i])**2 \
-            + (z[i] - z[:i])**2) - 2 * radius
+        d[i, :i] = np.sqrt(_periodic_delta(x[i], x[:i], lx)**2 \
+            + _periodic_delta(y[i], y[:i], ly)**2 \
+            + _periodic_delta(z[i], z[:i], lz)**2) \
+            - _radius_sum(radius, i, slice(None, i))
     return d
 
 @timer
-def find_distances_6(x, y, z, radius):
+def find_distances_6(x, y, z, radius, condensed=False):
     """Find distances between all particles. Vectorized implementation 3.
 
     Args:
         x: NumPy array of particle x coordinates
         y: NumPy array of particle y coordinates
         z: NumPy array of particle z coordinates
+        radius: particle radius, the same for every particle
+        condensed: if True, return only the distances between distinct
+            pairs as a 1D array, in the layout used by
+            scipy.spatial.distance.squareform. See condensed_index.
 
     Returns:
-        2D NumPy array of center-center distances
+        2D NumPy array of center-center distances, or 1D if condensed
     """
     assert len(x) == len(y) == len(z)  # primitive input validation
+    assert np.ndim(radius) == 0, \
+        "one radius for all particles; find_distances_5 takes one per particle"
+
+    if condensed:
+        n = len(x)
+        d = np.zeros(n * (n - 1) // 2)
+        start = 0
+        for i in range(n - 1):
+            stop = start + n - i - 1
+            d[start:stop] = np.sqrt( np.power((x[i] - x[i+1:]),2) \
+                + np.power((y[i] - y[i+1:]),2) \
+                + np.power((z[i] - z[i+1:]), 2)) - 2 * radius
+            start = stop
+        return d
 
     d = np.zeros((len(x), len(x)))  # center-center distances
 
@@ -156,3 +237,640 @@ def find_distances_6(x, y, z, radius):
             - 2 * radius
     return d
 
+def _as_radius(radius):
+    """Return radius as a scalar or NumPy array.
+
+    Arrays, including np.memmap, are returned as they are rather than copied.
+    """
+    if np.ndim(radius) == 0 or isinstance(radius, np.ndarray):
+        return radius
+    return np.asarray(radius, dtype=float)
+
+def _radius_sum(radius, i, j):
+    """Return the center-center distance at which particles i and j touch.
+
+    radius is a scalar, or an array with one radius per particle, in which
+    case i and j may be indices, slices or index arrays.
+    """
+    if np.ndim(radius) == 0:
+        return 2 * radius
+    return np.add(radius[i], radius[j], dtype=float)
+
+def _box_lengths(box):
+    """Return (Lx, Ly, Lz) for a periodic box, or Nones if box is None."""
+    if box is None:
+        return None, None, None
+    lengths = np.broadcast_to(np.asarray(box, dtype=float), (3,))
+    assert np.all(lengths > 0), "box lengths must be positive"
+    return tuple(lengths.tolist())
+
+def _periodic_delta(a, b, length):
+    """Return a - b, moved to the nearest periodic image if length is given."""
+    delta = a - b
+    if length is not None:
+        delta -= length * np.rint(delta / length)  # minimum image convention
+    return delta
+
+def condensed_index(n, i, j):
+    """Find where a pair of particles is stored in a condensed distance array.
+
+    Condensed arrays hold the distance between each pair of distinct
+    particles once, row by row from the upper triangle of the full matrix,
+    as in scipy.spatial.distance.squareform. That takes half the memory of
+    the full matrix.
+
+    Args:
+        n: number of particles
+        i: particle index or NumPy array of indices
+        j: particle index or NumPy array of indices, with j != i
+
+    Returns:
+        Position(s) in the condensed array of the distance between i and j
+    """
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    return n * i - i * (i + 1) // 2 + (j - i - 1)
+
+def condensed_pairs(n, k):
+    """Find the pair of particles stored at position(s) k of a condensed array.
+
+    Args:
+        n: number of particles
+        k: position or NumPy array of positions in the condensed array
+
+    Returns:
+        Tuple (i, j) of particle indices with i > j, so they index the lower
+        triangle like the full matrices returned by find_distances_5
+    """
+    row = np.arange(n)
+    row_start = n * row - row * (row + 1) // 2  # condensed_index(n, row, row+1)
+    j = np.searchsorted(row_start, k, side='right') - 1
+    i = k - row_start[j] + j + 1
+    return i, j
+
+def condensed_where(condition):
+    """Equivalent of np.where on the lower triangle, for condensed arrays.
+
+    For example, condensed_where(d < 0.0) finds overlapping spheres from the
+    condensed output of find_distances_5 without building the full matrix.
+
+    Args:
+        condition: 1D boolean NumPy array in condensed layout
+
+    Returns:
+        Tuple (i, j) of NumPy arrays of particle indices with i > j, in the
+        same order as np.where on the lower triangle of the full matrix
+    """
+    m = len(condition)
+    n = int(round((1 + np.sqrt(1 + 8 * m)) / 2))  # m = n * (n - 1) / 2
+    assert n * (n - 1) // 2 == m, "not a condensed distance array"
+
+    i, j = condensed_pairs(n, np.flatnonzero(condition))
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+
+# Offsets to half of the 26 cells surrounding a cell in a 3D grid. Comparing
+# each cell with itself and these 13 neighbors visits every pair of adjacent
+# cells exactly once.
+_HALF_SHELL = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+    for dz in (-1, 0, 1) if (dx, dy, dz) > (0, 0, 0)]
+
+def _ramp(counts):
+    """Concatenate np.arange(c) for every c in counts, without a Python loop."""
+    ends = np.cumsum(counts)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - counts,
+        counts)
+
+def _cell_width(extent, reach, max_cells):
+    """Return a cell width of at least reach that gives at most max_cells
+    cells over extent.
+
+    Cells wider than reach are still correct, just less selective. Without
+    a limit, a sparse system with a tiny reach would need more cells than
+    a cell index can count.
+    """
+    width = reach
+    while True:
+        cells = np.prod(np.floor(np.asarray(extent, dtype=float) / width) + 1)
+        if cells <= max_cells:
+            return width
+        width *= max(1.1, (cells / max_cells)**(1 / 3.0))
+
+@timer
+def find_neighbors(x, y, z, radius, cutoff, box=None, chunk=65536):
+    """Find pairs of particles closer than a cutoff. Cell list implementation.
+
+    Space is divided into a uniform grid of cubic cells, each as wide as the
+    largest center-center distance of interest, so a particle only needs to
+    be compared with particles in its own cell and the 26 cells around it.
+    For roughly uniform density this takes O(N) time and memory instead of
+    the O(N^2) needed to build the full distance matrix.
+
+    Args:
+        x: NumPy array of particle x coordinates
+        y: NumPy array of particle y coordinates
+        z: NumPy array of particle z coordinates
+        radius: particle radius, or NumPy array with one radius per
+            particle
+        cutoff: report pairs whose edge-edge distance is less than this.
+            Use 0.0 to find overlapping spheres.
+        box: optional side length of a periodic domain, as a float or
+            (Lx, Ly, Lz). Cells then wrap around the domain and distances
+            follow the minimum image convention.
+        chunk: number of particles processed at a time. Coordinates may be
+            np.memmap arrays (see particle_store.py), which are then read a
+            chunk at a time rather than copied into memory.
+
+    Returns:
+        Tuple (i, j, d) of 1D NumPy arrays in sparse COO format, where d[k]
+        is the edge-edge distance between particles i[k] > j[k]. Pairs are
+        sorted like np.where(d < cutoff) on the lower triangle returned by
+        find_distances_5. Use scipy.sparse.coo_matrix((d, (i, j))) to get a
+        SciPy sparse matrix.
+    """
+    assert len(x) == len(y) == len(z)  # primitive input validation
+
+    n = len(x)
+    radius = _as_radius(radius)
+    x, y, z = (c if isinstance(c, np.ndarray) else np.asarray(c, dtype=float)
+        for c in (x, y, z))
+
+    # Largest center-center distance of interest
+    reach = cutoff + 2 * np.max(radius) if n else 0.0
+    if n < 2 or reach <= 0:
+        return (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp),
+            np.zeros(0))
+
+    # Around a few cells per particle at most; more would mostly be empty
+    max_cells = 4 * n + 27
+    shell = _HALF_SHELL
+    lengths = _box_lengths(box)
+    if box is None:
+        lo = np.array([np.min(x), np.min(y), np.min(z)], dtype=float)
+        hi = np.array([np.max(x), np.max(y), np.max(z)], dtype=float)
+        width = _cell_width(hi - lo, reach, max_cells)
+        dims = np.floor((hi - lo) / width).astype(np.intp) + 1
+    else:
+        # Wrapped neighbors of a cell would repeat with fewer than 3 cells
+        # along an axis, so use a single cell along such axes
+        lo = 0.0
+        width = _cell_width(lengths, reach, max_cells)
+        dims = np.floor(np.array(lengths) / width).astype(np.intp)
+        dims[dims < 3] = 1
+        width = np.array(lengths) / dims
+        shell = [offset for offset in _HALF_SHELL
+            if all(dims[k] > 1 or offset[k] == 0 for k in range(3))]
+
+    # Assign every particle to a cell, a chunk at a time so coordinates in
+    # an np.memmap are never all loaded at once, then sort particles by cell
+    keys = np.empty(n, dtype=np.intp)
+    for s0 in range(0, n, chunk):
+        s1 = min(s0 + chunk, n)
+        pos = np.column_stack((x[s0:s1], y[s0:s1], z[s0:s1])).astype(float)
+        if box is not None:
+            pos = np.mod(pos, lengths)
+        coords = np.minimum(np.floor((pos - lo) / width).astype(np.intp),
+            dims - 1)
+        keys[s0:s1] = np.ravel_multi_index(coords.T, dims)
+    order = np.argsort(keys, kind='mergesort')
+    cells, starts, counts = np.unique(keys[order], return_index=True,
+        return_counts=True)
+    del keys
+    cell_coords = np.column_stack(np.unravel_index(cells, dims))
+
+    found_i, found_j, found_d = [], [], []
+
+    def keep(first, second):
+        # Compute distances for candidate pairs of sorted particles and keep
+        # the ones within the cutoff
+        a, b = order[first], order[second]
+        d = np.zeros(len(a))
+        for c, length in zip((x, y, z), lengths):
+            d += _periodic_delta(np.asarray(c[a], dtype=float), c[b],
+                length)**2
+        np.sqrt(d, out=d)
+        d -= _radius_sum(radius, a, b)
+        close = d < cutoff
+        found_i.append(np.maximum(a[close], b[close]))
+        found_j.append(np.minimum(a[close], b[close]))
+        found_d.append(d[close])
+
+    # Visit particles in cell order, a chunk at a time, so the candidate
+    # pairs held in memory are bounded by the chunk size
+    for s0 in range(0, n, chunk):
+        s1 = min(s0 + chunk, n)
+        sorted_ids = np.arange(s0, s1)
+        cell = np.searchsorted(starts, sorted_ids, side='right') - 1
+        c0 = cell[0]
+        local_cells = slice(c0, cell[-1] + 1)
+
+        # Pairs within a cell: each particle against the ones sorted before it
+        rank = sorted_ids - starts[cell]
+        keep(np.repeat(sorted_ids, rank),
+            np.repeat(starts[cell], rank) + _ramp(rank))
+
+        # Pairs between neighboring cells
+        for offset in shell:
+            neighbor = cell_coords[local_cells] + offset
+            if box is not None:
+                neighbor %= dims
+            inside = np.all((neighbor >= 0) & (neighbor < dims), axis=1)
+            neighbor_keys = np.ravel_multi_index(neighbor[inside].T, dims)
+            match = np.minimum(np.searchsorted(cells, neighbor_keys),
+                len(cells) - 1)
+            occupied = cells[match] == neighbor_keys
+
+            neighbor_count = np.zeros(len(neighbor), dtype=np.intp)
+            neighbor_start = np.zeros(len(neighbor), dtype=np.intp)
+            neighbor_count[np.flatnonzero(inside)[occupied]] = \
+                counts[match[occupied]]
+            neighbor_start[np.flatnonzero(inside)[occupied]] = \
+                starts[match[occupied]]
+
+            per_particle = neighbor_count[cell - c0]
+            keep(np.repeat(sorted_ids, per_particle),
+                np.repeat(neighbor_start[cell - c0], per_particle)
+                + _ramp(per_particle))
+
+    i = np.concatenate(found_i)
+    j = np.concatenate(found_j)
+    d = np.concatenate(found_d)
+    sort = np.lexsort((j, i))
+    return i[sort], j[sort], d[sort]
+
+def find_contacts(x, y, z, radius, thresholds, box=None):
+    """Find pairs of particles closer than each of several thresholds.
+
+    One neighbor search at the largest threshold finds every candidate
+    pair, which is then split by threshold, instead of one search (or one
+    full distance matrix) per threshold.
+
+    Args:
+        x: NumPy array of particle x coordinates
+        y: NumPy array of particle y coordinates
+        z: NumPy array of particle z coordinates
+        radius: particle radius, or NumPy array with one radius per
+            particle
+        thresholds: sequence of edge-edge distances
+        box: optional side length of a periodic domain, as a float or
+            (Lx, Ly, Lz), for minimum image distances
+
+    Returns:
+        List with one (i, j, d) tuple per threshold, in the format returned
+        by find_neighbors, holding the pairs closer than that threshold
+    """
+    if len(thresholds) == 0:
+        return []
+    i, j, d = find_neighbors(x, y, z, radius, max(thresholds), box=box)
+    contacts = []
+    for threshold in thresholds:
+        close = d < threshold
+        contacts.append((i[close], j[close], d[close]))
+    return contacts
+
+def _tile_distances(xi, yi, zi, xj, yj, zj, radius, acc, tmp, box=None,
+        wrap=None):
+    """Fill acc with edge-edge distances between two blocks of particles.
+
+    All arithmetic is done in place in the caller's scratch arrays acc and
+    tmp (and wrap, needed for a periodic box), which must have shape
+    (len(xi), len(xj)), so nothing is allocated. radius is a scalar or a
+    tuple of (radii of block i, radii of block j).
+    """
+    lengths = _box_lengths(box)
+    for k, (ci, cj) in enumerate(((xi, xj), (yi, yj), (zi, zj))):
+        np.subtract(ci[:, np.newaxis], cj, out=tmp)
+        if lengths[k] is not None:  # minimum image convention
+            np.divide(tmp, lengths[k], out=wrap)
+            np.rint(wrap, out=wrap)
+            np.multiply(wrap, lengths[k], out=wrap)
+            np.subtract(tmp, wrap, out=tmp)
+        if k == 0:
+            np.multiply(tmp, tmp, out=acc)
+        else:
+            np.multiply(tmp, tmp, out=tmp)
+            np.add(acc, tmp, out=acc)
+    np.sqrt(acc, out=acc)
+    if isinstance(radius, tuple):
+        np.subtract(acc, radius[0][:, np.newaxis], out=acc)
+        np.subtract(acc, radius[1], out=acc)
+    else:
+        np.subtract(acc, 2 * radius, out=acc)
+    return acc
+
+@timer
+def find_distances_tiled(x, y, z, radius, block=1024, dtype=np.float64,
+        out=None, box=None):
+    """Find distances between all particles. Tiled implementation.
+
+    The lower triangle is computed one block x block tile at a time, so the
+    temporaries never grow with N and each tile stays in cache. Combined with
+    a np.memmap for out, this handles N too large for the dense float64
+    matrix to fit in RAM.
+
+    Args:
+        x: NumPy array of particle x coordinates
+        y: NumPy array of particle y coordinates
+        z: NumPy array of particle z coordinates
+        radius: particle radius, or NumPy array with one radius per
+            particle
+        block: number of particles along each side of a tile
+        dtype: dtype of the matrix to allocate if out is not given, e.g.
+            np.float32 to halve the memory
+        out: optional N x N array or np.memmap to write the result into.
+            Only its strict lower triangle is written.
+        box: optional side length of a periodic domain, as a float or
+            (Lx, Ly, Lz), for minimum image distances
+
+    Returns:
+        2D NumPy array of edge-edge distances (out, if given), with values
+        in the strict lower triangle
+    """
+    assert len(x) == len(y) == len(z)  # primitive input validation
+
+    n = len(x)
+    if out is None:
+        out = np.zeros((n, n), dtype=dtype)
+    assert out.shape == (n, n)
+    block = max(1, min(block, n))
+    radius = _as_radius(radius)
+
+    # Scratch space shared by every tile
+    acc = np.empty((block, block))
+    tmp = np.empty((block, block))
+    wrap = np.empty((block, block)) if box is not None else None
+    below_diagonal = np.tri(block, k=-1, dtype=bool)
+
+    for i0 in range(0, n, block):
+        i1 = min(i0 + block, n)
+        xi = np.asarray(x[i0:i1], dtype=float)
+        yi = np.asarray(y[i0:i1], dtype=float)
+        zi = np.asarray(z[i0:i1], dtype=float)
+
+        for j0 in range(0, i1, block):
+            j1 = min(j0 + block, i1)
+            h, w = i1 - i0, j1 - j0
+            tile_radius = radius if np.ndim(radius) == 0 else \
+                (radius[i0:i1], radius[j0:j1])
+            _tile_distances(xi, yi, zi, x[j0:j1], y[j0:j1], z[j0:j1],
+                tile_radius, acc[:h, :w], tmp[:h, :w], box,
+                None if wrap is None else wrap[:h, :w])
+            if j0 == i0:  # tile on the diagonal
+                np.copyto(out[i0:i1, j0:j1], acc[:h, :w],
+                    where=below_diagonal[:h, :w])
+            else:
+                out[i0:i1, j0:j1] = acc[:h, :w]
+    return out
+
+@timer
+def find_distances_gemm(x, y, z, radius):
+    """Find distances between all particles. Matrix multiply implementation.
+
+    Uses the identity |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, so the only O(N^2)
+    work is one matrix product, which NumPy hands to BLAS, plus broadcasting.
+    There is no Python loop over particles. The subtraction loses precision
+    for nearby particles far from the origin, so results agree with the other
+    implementations only to a tolerance.
+
+    Args:
+        x: NumPy array of particle x coordinates
+        y: NumPy array of particle y coordinates
+        z: NumPy array of particle z coordinates
+        radius: particle radius, or NumPy array with one radius per
+            particle
+
+    Returns:
+        2D NumPy array of center-center distances
+    """
+    assert len(x) == len(y) == len(z)  # primitive input validation
+
+    p = np.column_stack((x, y, z)).astype(float)  # N x 3 positions
+    sq = np.einsum('ij,ij->i', p, p)  # squared norm of each position
+
+    d = np.dot(p, p.T)
+    d *= -2.0
+    d += sq[:, np.newaxis]
+    d += sq[np.newaxis, :]
+    np.maximum(d, 0.0, out=d)  # cancellation can leave tiny negative values
+    np.sqrt(d, out=d)
+    radius = _as_radius(radius)
+    if np.ndim(radius):
+        d -= radius[:, np.newaxis]
+        d -= radius[np.newaxis, :]
+    else:
+        d -= 2 * radius
+    return d
+
+# Work arrays kept between calls of find_distances_fused, by name
+_work_arrays = {}
+
+def _work_array(name, shape):
+    """Return a float work array of the given shape, reusing earlier memory.
+
+    A new array is only allocated when a larger one is needed than any
+    requested before under the same name. Not thread safe.
+    """
+    size = int(np.prod(shape))
+    buf = _work_arrays.get(name)
+    if buf is None or buf.size < size:
+        buf = _work_arrays[name] = np.empty(size)
+    return buf[:size].reshape(shape)
+
+@timer
+def find_distances_fused(x, y, z, radius, out=None):
+    """Find distances between all particles. Fused in-place implementation.
+
+    Like find_distances_5, but every operation writes into preallocated
+    memory with out= arguments and np.einsum sums the squares in one pass,
+    so no temporary arrays are created per row. Work arrays are kept between
+    calls, so when out is also supplied, a call allocates nothing once the
+    first call has warmed up.
+
+    Args:
+        x: NumPy array of particle x coordinates
+        y: NumPy array of particle y coordinates
+        z: NumPy array of particle z coordinates
+        radius: particle radius, or NumPy array with one radius per
+            particle
+        out: optional N x N array to write the result into. Only its strict
+            lower triangle is written.
+
+    Returns:
+        2D NumPy array of center-center distances (out, if given)
+    """
+    assert len(x) == len(y) == len(z)  # primitive input validation
+
+    n = len(x)
+    if out is None:
+        out = np.zeros((n, n))
+    assert out.shape == (n, n)
+
+    radius = _as_radius(radius)
+
+    p = _work_array('positions', (3, n))
+    np.copyto(p[0], x)
+    np.copyto(p[1], y)
+    np.copyto(p[2], z)
+    delta = _work_array('delta', (3, n))
+
+    for i in range(1, n):
+        row = out[i, :i]
+        np.subtract(p[:, i:i+1], p[:, :i], out=delta[:, :i])
+        np.einsum('ij,ij->j', delta[:, :i], delta[:, :i], out=row,
+            casting='same_kind')
+        np.sqrt(row, out=row)
+        if np.ndim(radius):
+            np.subtract(row, radius[i], out=row)
+            np.subtract(row, radius[:i], out=row)
+        else:
+            np.subtract(row, 2 * radius, out=row)
+    return out
+
+def _distance_rows(name, n, start, stop, x, y, z, radius, box):
+    """Worker for find_distances_parallel. Fills rows start:stop in place."""
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        d = np.ndarray((n, n), dtype=np.float64, buffer=shm.buf)
+        # Same arithmetic as find_distances_5, so results are identical
+        lx, ly, lz = _box_lengths(box)
+        for i in range(start, stop):
+            d[i, :i] = np.sqrt(_periodic_delta(x[i], x[:i], lx)**2 \
+                + _periodic_delta(y[i], y[:i], ly)**2 \
+                + _periodic_delta(z[i], z[:i], lz)**2) \
+                - _radius_sum(radius, i, slice(None, i))
+        del d  # release the buffer so the block can be closed
+    finally:
+        shm.close()
+
+@timer
+def find_distances_parallel(x, y, z, radius, workers=None, box=None):
+    """Find distances between all particles. Multi-process implementation.
+
+    The lower triangle is split into one band of rows per worker process.
+    Row i holds i distances, so band boundaries are spaced as sqrt(k/workers)
+    to give every worker the same number of distances. Workers write straight
+    into a matrix in shared memory, so no results are pickled back.
+
+    Args:
+        x: NumPy array of particle x coordinates
+        y: NumPy array of particle y coordinates
+        z: NumPy array of particle z coordinates
+        radius: particle radius, or NumPy array with one radius per
+            particle
+        workers: number of worker processes (default: number of CPUs)
+        box: optional side length of a periodic domain, as a float or
+            (Lx, Ly, Lz), for minimum image distances
+
+    Returns:
+        2D NumPy array of center-center distances, backed by the shared
+        memory the workers wrote into
+    """
+    from multiprocessing import Pool, cpu_count, shared_memory
+
+    assert len(x) == len(y) == len(z)  # primitive input validation
+
+    n = len(x)
+    workers = workers or cpu_count()
+    x, y, z = (np.asarray(c, dtype=float) for c in (x, y, z))
+    radius = _as_radius(radius)
+
+    bounds = [int(round(n * np.sqrt(k / float(workers))))
+        for k in range(workers + 1)]
+    tasks = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])
+        if stop > start]
+
+    # New shared memory is zero-filled, like np.zeros
+    shm = shared_memory.SharedMemory(create=True, size=max(n * n * 8, 1))
+    try:
+        pool = Pool(min(workers, max(len(tasks), 1)))
+        try:
+            pool.starmap(_distance_rows, [(shm.name, n, start, stop, x, y, z,
+                radius, box) for start, stop in tasks])
+        finally:
+            pool.close()
+            pool.join()
+    except BaseException:
+        shm.close()
+        raise
+    finally:
+        shm.unlink()  # the name goes, the mapping stays until closed
+
+    # Return the shared block itself rather than a copy, which would take
+    # serial O(N^2) time and twice the memory. It is unmapped when the
+    # array, and every view of it, has been garbage collected.
+    d = np.ndarray((n, n), dtype=np.float64, buffer=shm.buf)
+    weakref.finalize(d, shm.close)
+    return d
+
+# Record layout of the pairs yielded by iter_overlaps
+OVERLAP_DTYPE = np.dtype([('i', np.intp), ('j', np.intp), ('gap', float)])
+
+def iter_overlaps(x, y, z, radius, chunk=1024, cutoff=0.0, box=None):
+    """Generate overlapping pairs of particles, one block of rows at a time.
+
+    Distances are computed chunk x chunk tiles at a time and only the close
+    pairs are kept, so memory is bounded by the chunk size no matter how
+    many particles there are, and the first pairs are available long before
+    the scan is finished.
+
+    Args:
+        x: NumPy array of particle x coordinates
+        y: NumPy array of particle y coordinates
+        z: NumPy array of particle z coordinates
+        radius: particle radius, or NumPy array with one radius per
+            particle
+        chunk: number of rows (and columns) of the distance matrix per tile
+        cutoff: report pairs whose edge-edge distance is less than this
+        box: optional side length of a periodic domain, as a float or
+            (Lx, Ly, Lz), for minimum image distances
+
+    Yields:
+        NumPy record arrays of dtype OVERLAP_DTYPE with fields i, j (i > j)
+        and gap (edge-edge distance), sorted by i then j. Blocks without
+        overlaps are skipped.
+    """
+    assert len(x) == len(y) == len(z)  # primitive input validation
+
+    n = len(x)
+    chunk = max(1, min(chunk, n))
+    radius = _as_radius(radius)
+
+    # Scratch space shared by every tile
+    acc = np.empty((chunk, chunk))
+    tmp = np.empty((chunk, chunk))
+    wrap = np.empty((chunk, chunk)) if box is not None else None
+    close = np.empty((chunk, chunk), dtype=bool)
+    below_diagonal = np.tri(chunk, k=-1, dtype=bool)
+
+    for i0 in range(0, n, chunk):
+        i1 = min(i0 + chunk, n)
+        xi = np.asarray(x[i0:i1], dtype=float)
+        yi = np.asarray(y[i0:i1], dtype=float)
+        zi = np.asarray(z[i0:i1], dtype=float)
+
+        found = []
+        for j0 in range(0, i1, chunk):
+            j1 = min(j0 + chunk, i1)
+            h, w = i1 - i0, j1 - j0
+            tile_radius = radius if np.ndim(radius) == 0 else \
+                (radius[i0:i1], radius[j0:j1])
+            _tile_distances(xi, yi, zi, x[j0:j1], y[j0:j1], z[j0:j1],
+                tile_radius, acc[:h, :w], tmp[:h, :w], box,
+                None if wrap is None else wrap[:h, :w])
+            np.less(acc[:h, :w], cutoff, out=close[:h, :w])
+            if j0 == i0:  # tile on the diagonal
+                np.logical_and(close[:h, :w], below_diagonal[:h, :w],
+                    out=close[:h, :w])
+            rows, cols = np.nonzero(close[:h, :w])
+            if len(rows):
+                batch = np.empty(len(rows), dtype=OVERLAP_DTYPE)
+                batch['i'] = rows + i0
+                batch['j'] = cols + j0
+                batch['gap'] = acc[rows, cols]
+                found.append(batch)
+
+        if found:
+            batch = np.concatenate(found)
+            yield batch[np.lexsort((batch['j'], batch['i']))]
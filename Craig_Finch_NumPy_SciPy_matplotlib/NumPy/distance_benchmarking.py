@@ -1,43 +1,211 @@
-import numpy as np
+"""Benchmark the distance functions over a range of problem sizes.
+
+Each variant is run a few times untimed to warm up, then timed with
+time.perf_counter over several repeats. One more run under tracemalloc
+records the peak memory allocated; for find_distances_fused_out, which
+reuses its output matrix, this should be close to zero. Results can be saved
+as JSON and compared with an earlier run to catch regressions, e.g. after a
+NumPy upgrade:
+
+    python distance_benchmarking.py --output before.json
+    (upgrade NumPy)
+    python distance_benchmarking.py --output after.json --compare before.json
+
+Use --snapshot to benchmark particles stored with particle_store.py. They
+are memory-mapped rather than loaded, and only find_neighbors is run unless
+--variants says otherwise. Every find_distances_* variant, including
+find_distances_tiled, returns the whole N x N matrix, and iter_overlaps
+keeps memory bounded but still visits all N^2 pairs, so none of them is
+practical for the millions of particles a snapshot may hold.
+"""
+
+import argparse
 import cProfile
-from distance import *
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import distance
+import particle_store
+
+def _undecorated(func):
+    """Return func without the timer decorator, which would add noise."""
+    return getattr(func, '__wrapped__', func)
+
+def _reusing_output(func):
+    """Wrap func so every call writes into the same preallocated matrix.
+
+    The matrix is allocated on the first call for each N, which is a warmup
+    run, so peak memory then shows only what func allocates itself.
+    """
+    outputs = {}
+
+    def run(x, y, z, radius):
+        if len(x) not in outputs:
+            outputs[len(x)] = np.zeros((len(x), len(x)))
+        return func(x, y, z, radius, out=outputs[len(x)])
+
+    return run
+
+# Functions to benchmark, with the largest N each one is practical for
+VARIANTS = {
+    'find_distances_1': (distance.find_distances_1, 1000),
+    'find_distances_2': (distance.find_distances_2, 1000),
+    'find_distances_3': (distance.find_distances_3, None),
+    'find_distances_4': (distance.find_distances_4, None),
+    'find_distances_5': (distance.find_distances_5, None),
+    'find_distances_6': (distance.find_distances_6, None),
+    'find_distances_gemm': (distance.find_distances_gemm, None),
+    'find_distances_fused': (distance.find_distances_fused, None),
+    'find_distances_fused_out': (_reusing_output(
+        _undecorated(distance.find_distances_fused)), None),
+    'find_distances_tiled': (distance.find_distances_tiled, None),
+    'find_distances_parallel': (distance.find_distances_parallel, None),
+    'find_neighbors': (lambda x, y, z, radius:
+        distance.find_neighbors(x, y, z, radius, 0.0), None),
+    'iter_overlaps': (lambda x, y, z, radius:
+        sum(len(pairs) for pairs in distance.iter_overlaps(x, y, z, radius)),
+        None),
+}
+
+# Variants whose time and memory grow about linearly with N, the default
+# for --snapshot
+SNAPSHOT_VARIANTS = ['find_neighbors']
+
+def make_spheres(num_spheres, domain_size, seed):
+    """Return x, y, z coordinates of randomly placed spheres."""
+    rng = np.random.RandomState(seed=seed)
+    x = rng.uniform(0, domain_size, num_spheres)
+    y = rng.uniform(0, domain_size, num_spheres)
+    z = rng.uniform(0, domain_size, num_spheres)
+    return x, y, z
+
+def benchmark(func, args, repeats, warmup):
+    """Time func(*args) and measure its peak memory.
+
+    Returns:
+        dict with median and interquartile range of the run time (seconds),
+        the fastest run, and the peak bytes allocated by one call
+    """
+    for _ in range(warmup):
+        func(*args)
+
+    times = []
+    for _ in range(repeats):
+        t1 = time.perf_counter()
+        func(*args)
+        t2 = time.perf_counter()
+        times.append(t2 - t1)
+
+    # Separate run, because tracing allocations slows the code down
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {'median': median, 'iqr': q3 - q1, 'min': min(times),
+        'peak_bytes': peak, 'repeats': repeats}
 
-# SETUP
-radius = 1.0
-domain_size = 50.0
-num_spheres = 1000
+def compare(results, baseline, threshold):
+    """Find results whose median time grew by more than threshold.
 
-# Benchmark non-vectorized versions
-print("Benchmarking with 1000 particles.")
-rng = np.random.RandomState(seed=1)
+    Returns:
+        list of (variant, n, old median, new median) tuples
+    """
+    old = dict(((r['variant'], r['n']), r['median']) for r in baseline)
+    regressions = []
+    for r in results:
+        key = (r['variant'], r['n'])
+        if key in old and r['median'] > old[key] * (1.0 + threshold):
+            regressions.append((key[0], key[1], old[key], r['median']))
+    return regressions
 
-x = rng.uniform(0, domain_size, num_spheres)
-y = rng.uniform(0, domain_size, num_spheres)
-z = rng.uniform(0, domain_size, num_spheres)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 3000],
+        help='numbers of spheres to benchmark (default: 1000 3000)')
+    parser.add_argument('--variants', nargs='+', choices=sorted(VARIANTS),
+        help='functions to benchmark (default: all, or find_neighbors '
+        'with --snapshot)')
+    parser.add_argument('--repeats', type=int, default=5,
+        help='timed runs per variant and size (default: 5)')
+    parser.add_argument('--warmup', type=int, default=1,
+        help='untimed runs before timing (default: 1)')
+    parser.add_argument('--radius', type=float, default=1.0)
+    parser.add_argument('--domain-size', type=float, default=50.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--snapshot', metavar='PATH',
+        help='use particles from a snapshot instead of random ones; '
+        '--sizes is ignored and --variants defaults to find_neighbors')
+    parser.add_argument('--output', help='save results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE',
+        help='JSON file from an earlier run to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.1,
+        help='flag slowdowns larger than this fraction (default: 0.1)')
+    parser.add_argument('--profile', metavar='VARIANT', choices=sorted(VARIANTS),
+        help='run one variant under cProfile instead of benchmarking')
+    args = parser.parse_args(argv)
+    if args.variants is None:
+        args.variants = SNAPSHOT_VARIANTS if args.snapshot \
+            else sorted(VARIANTS)
+    return args
 
-find_distances_1(x, y, z, radius)
-find_distances_2(x, y, z, radius)
-find_distances_3(x, y, z, radius)
+def main(argv=None):
+    args = parse_args(argv)
 
-# Benchmark vectorized codes
-print("Benchmarking with 3000 particles.")
+    if args.snapshot:
+        x, y, z, radius = particle_store.load_snapshot(args.snapshot)
+        inputs = [(x, y, z, args.radius if radius is None else radius)]
+    else:
+        inputs = (make_spheres(n, args.domain_size, args.seed)
+            + (args.radius,) for n in args.sizes)
 
-num_spheres = 3000
+    if args.profile:
+        func = _undecorated(VARIANTS[args.profile][0])
+        x, y, z, radius = next(iter(inputs))
+        cProfile.runctx('func(x, y, z, radius)', globals(),
+            {'func': func, 'x': x, 'y': y, 'z': z, 'radius': radius})
+        return 0
 
-rng = np.random.RandomState(seed=1)
+    results = []
+    print('{:<24} {:>7} {:>12} {:>12} {:>14}'.format('variant', 'N',
+        'median (s)', 'IQR (s)', 'peak (bytes)'))
+    for x, y, z, radius in inputs:
+        n = len(x)
+        for name in args.variants:
+            func, max_n = VARIANTS[name]
+            if max_n is not None and n > max_n:
+                continue
+            r = benchmark(_undecorated(func), (x, y, z, radius),
+                args.repeats, args.warmup)
+            r.update(variant=name, n=n)
+            results.append(r)
+            print('{:<24} {:>7} {:>12.6f} {:>12.6f} {:>14}'.format(name, n,
+                r['median'], r['iqr'], r['peak_bytes']))
 
-x = rng.uniform(0, domain_size, num_spheres)
-y = rng.uniform(0, domain_size, num_spheres)
-z = rng.uniform(0, domain_size, num_spheres)
+    if args.output:
+        meta = {'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
 
-find_distances_3(x, y, z, radius)
-find_distances_4(x, y, z, radius)
-find_distances_5(x, y, z, radius)
-find_distances_6(x, y, z, radius)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, n, old, new in regressions:
+            print('REGRESSION {} N={}: {:.6f} s -> {:.6f} s ({:+.0%})'.format(
+                name, n, old, new, new / old - 1.0))
+        if regressions:
+            return 1
+    return 0
 
-#cProfile.run('find_distances_1(x, y, z, radius)')
-#cProfile.run('find_distances_2(x, y, z, radius)')
-#cProfile.run('find_distances_3(x, y, z, radius)')
-#cProfile.run('find_distances_4(x, y, z, radius)')
-#cProfile.run('find_distances_5(x, y, z, radius)')
-#cProfile.run('find_distances_6(x, y, z, radius)')
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,13 @@
 import numpy as np
 from distance import *
+from collision_tracker import CollisionTracker
 
 # SETUP
 radius = 1.0
 domain_size = 5.0
 num_spheres = 5
 delta = 1e-6	# tolerance for checking whether matrices are "identical"
+delta_gemm = 1e-6 * domain_size	# find_distances_gemm loses some precision
 
 # Set random seed so same pseudo-random numbers are used for every run
 rng = np.random.RandomState(seed=1)
@@ -21,6 +23,9 @@ d3 = find_distances_3(x, y, z, radius)
 d4 = find_distances_4(x, y, z, radius)
 d5 = find_distances_5(x, y, z, radius)
 d6 = find_distances_6(x, y, z, radius)
+d_gemm = find_distances_gemm(x, y, z, radius)
+d_parallel = find_distances_parallel(x, y, z, radius)
+d_fused = find_distances_fused(x, y, z, radius)
 
 print(d1)
 print(d2)
@@ -28,6 +33,9 @@ print(d3)
 print(d4)
 print(d5)
 print(d6)
+print(d_gemm)
+print(d_parallel)
+print(d_fused)
 
 # Idea for unit-testing floating point code with NumPy
 
@@ -38,3 +46,94 @@ assert(np.max(abs(np.tril(d1, k=-1) - np.tril(d3, k=-1))) < delta)
 assert(np.max(abs(np.tril(d1, k=-1) - np.tril(d4, k=-1))) < delta)
 assert(np.max(abs(np.tril(d1, k=-1) - np.tril(d5, k=-1))) < delta)
 assert(np.max(abs(np.tril(d1, k=-1) - np.tril(d6, k=-1))) < delta)
+assert(np.max(abs(np.tril(d1, k=-1) - np.tril(d_fused, k=-1))) < delta)
+
+# The matrix-multiply version subtracts large, nearly equal numbers, so check
+# it with a looser tolerance
+assert(np.max(abs(np.tril(d1, k=-1) - np.tril(d_gemm, k=-1))) < delta_gemm)
+
+# The parallel version does the same arithmetic as find_distances_5, split
+# across processes, so it should match exactly
+assert(np.array_equal(d5, d_parallel))
+
+# Condensed output holds the same distances as the lower triangle
+for find_distances in (find_distances_2, find_distances_5, find_distances_6):
+    d_condensed = find_distances(x, y, z, radius, condensed=True)
+    i, j = condensed_pairs(num_spheres, np.arange(len(d_condensed)))
+    assert(np.max(abs(d1[i, j] - d_condensed)) < delta)
+
+# Polydisperse spheres: one radius per sphere
+radii = rng.uniform(0.5, 1.5, num_spheres)
+d5 = find_distances_5(x, y, z, radii)
+assert(np.max(abs(np.tril(d5, k=-1) - find_distances_fused(x, y, z, radii))) < delta)
+assert(np.max(abs(np.tril(d5, k=-1) - np.tril(find_distances_gemm(x, y, z, radii), k=-1))) < delta_gemm)
+
+# The cell list finds the same close pairs, in the same order, as np.where
+# on the lower triangle of the full matrix, for one radius and for one per
+# sphere (find_distances_1 only takes a single radius)
+cutoff = 0.5
+for r, d_full in ((radius, d1), (radii, d5)):
+    i, j = np.where(np.tril(d_full < cutoff, k=-1))
+    i_cell, j_cell, d_cell = find_neighbors(x, y, z, r, cutoff)
+    assert(np.array_equal(i, i_cell) and np.array_equal(j, j_cell))
+    assert(np.max(abs(d_full[i, j] - d_cell), initial=0) < delta)
+
+# The tiled version, with blocks that do not divide the number of spheres,
+# and in single precision
+for block in (1, 2, 3, 1024):
+    d_tiled = find_distances_tiled(x, y, z, radius, block=block)
+    assert(np.max(abs(np.tril(d1, k=-1) - d_tiled)) < delta)
+d_tiled = find_distances_tiled(x, y, z, radius, block=2, dtype=np.float32)
+assert(d_tiled.dtype == np.float32)
+assert(np.max(abs(np.tril(d1, k=-1) - d_tiled)) < 1e-6 * domain_size)
+
+# The streaming version yields the same pairs, for any chunk size
+for r, d_full in ((radius, d1), (radii, d5)):
+    i, j = np.where(np.tril(d_full < cutoff, k=-1))
+    for chunk in (2, 3, 1024):
+        pairs = np.concatenate([np.zeros(0, dtype=OVERLAP_DTYPE)]
+            + list(iter_overlaps(x, y, z, r, chunk=chunk, cutoff=cutoff)))
+        assert(np.array_equal(i, pairs['i']) and np.array_equal(j, pairs['j']))
+        assert(np.max(abs(d_full[i, j] - pairs['gap']), initial=0) < delta)
+
+# Periodic box: compare with a brute-force minimum image matrix
+box = domain_size
+d_periodic = np.zeros((num_spheres, num_spheres))
+for i in range(num_spheres):
+    for j in range(num_spheres):
+        dx, dy, dz = x[i] - x[j], y[i] - y[j], z[i] - z[j]
+        dx -= box * round(dx / box)
+        dy -= box * round(dy / box)
+        dz -= box * round(dz / box)
+        d_periodic[i, j] = np.sqrt(dx**2 + dy**2 + dz**2) - 2 * radius
+d5 = find_distances_5(x, y, z, radius, box=box)
+assert(np.max(abs(np.tril(d_periodic, k=-1) - np.tril(d5, k=-1))) < delta)
+d_tiled = find_distances_tiled(x, y, z, radius, block=2, box=box)
+assert(np.max(abs(np.tril(d_periodic, k=-1) - d_tiled)) < delta)
+i, j = np.where(np.tril(d_periodic < cutoff, k=-1))
+i_cell, j_cell, d_cell = find_neighbors(x, y, z, radius, cutoff, box=box)
+assert(np.array_equal(i, i_cell) and np.array_equal(j, j_cell))
+assert(np.max(abs(d_periodic[i, j] - d_cell), initial=0) < delta)
+
+# The collision tracker keeps the same overlaps as a full recomputation
+# while spheres move: small moves, which mostly reuse the neighbor list,
+# and one large move, which forces a rebuild
+def overlaps_5(x, y, z):
+    i, j = np.where(np.tril(find_distances_5(x, y, z, radius) < 0.0, k=-1))
+    return list(zip(i.tolist(), j.tolist()))
+
+xt, yt, zt = x.copy(), y.copy(), z.copy()
+tracker = CollisionTracker(xt, yt, zt, radius)
+assert(tracker.overlaps() == overlaps_5(xt, yt, zt))
+for step in range(20):
+    moved = rng.choice(num_spheres, 2, replace=False)
+    xt[moved] += rng.uniform(-0.2, 0.2, 2)
+    yt[moved] += rng.uniform(-0.2, 0.2, 2)
+    zt[moved] += rng.uniform(-0.2, 0.2, 2)
+    tracker.update(moved, xt[moved], yt[moved], zt[moved])
+    assert(tracker.overlaps() == overlaps_5(xt, yt, zt))
+rebuilds = tracker.rebuilds
+xt[0] = yt[0] = zt[0] = domain_size / 2   # move sphere 0 far
+tracker.update([0], xt[:1], yt[:1], zt[:1])
+assert(tracker.rebuilds == rebuilds + 1)
+assert(tracker.overlaps() == overlaps_5(xt, yt, zt))
@@ -0,0 +1,201 @@
+"""Low-overhead call metrics for the timer decorator in distance.py.
+
+Every call to a decorated function is timed with time.perf_counter_ns and
+recorded in the module-level registry, which keeps a call count, total,
+minimum and maximum time, and a latency histogram per function. Nothing is
+printed. Results can be exported as JSON or in the Prometheus text format:
+
+    import metrics
+    print(metrics.registry.to_prometheus())
+
+Set the environment variable METRICS_EXPORT_FILE to write the metrics to that
+file when the interpreter exits (JSON if the name ends in .json, Prometheus
+text otherwise), so a script can be monitored without changing its code.
+Call disable() to turn timing off; a disabled decorator only checks a flag
+before calling the function.
+"""
+
+import atexit
+import json
+import os
+import threading
+
+enabled = True  # checked by the timer decorator on every call
+
+def enable():
+    """Turn on recording of call metrics."""
+    global enabled
+    enabled = True
+
+def disable():
+    """Turn off recording of call metrics."""
+    global enabled
+    enabled = False
+
+# Upper bounds of the Prometheus histogram buckets in nanoseconds: 1, 2 and 5
+# times each power of ten from 1 microsecond to 100 seconds. A fixed, short
+# list keeps the set of series the same from one scrape to the next.
+PROMETHEUS_BOUNDS_NS = [m * 10**e for e in range(3, 11) for m in (1, 2, 5)] \
+    + [10**11]
+
+class Histogram(object):
+    """Histogram of non-negative integers with logarithmic buckets.
+
+    As in HDR Histogram, each power of two is split into 2**sub_bits equal
+    buckets, so any value is stored with a relative error below 2**-sub_bits
+    (about 3% for the default) while the number of buckets only grows with
+    the logarithm of the largest value. Only non-empty buckets are stored.
+    """
+
+    def __init__(self, sub_bits=5):
+        self.sub_bits = sub_bits
+        self.counts = {}  # bucket index -> number of values
+
+    def _index(self, value):
+        shift = value.bit_length() - self.sub_bits - 1
+        if shift <= 0:
+            return value  # small values get exact buckets
+        return (shift << self.sub_bits) + (value >> shift)
+
+    def _lower(self, index):
+        """Smallest value that falls in bucket index."""
+        shift = (index >> self.sub_bits) - 1
+        if shift <= 0:
+            return index
+        return (index - (shift << self.sub_bits)) << shift
+
+    def record(self, value):
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+    def buckets(self):
+        """Return a sorted list of (upper bound, count) for non-empty buckets.
+
+        Upper bounds are inclusive, so a bucket holds values greater than the
+        previous bound and less than or equal to its own.
+        """
+        return [(self._lower(i + 1) - 1, self.counts[i])
+            for i in sorted(self.counts)]
+
+    def cumulative_counts(self, bounds):
+        """Return the number of values up to each bound, for sorted bounds.
+
+        A bucket counts towards the first bound at or above its upper
+        bound, so the counts are exact to within the bucket resolution.
+        """
+        counts = [0] * len(bounds)
+        k = 0
+        for upper, count in self.buckets():
+            while k < len(bounds) and bounds[k] < upper:
+                k += 1
+            if k == len(bounds):
+                break
+            counts[k] += count
+        for k in range(1, len(counts)):
+            counts[k] += counts[k - 1]
+        return counts
+
+    def percentile(self, q):
+        """Return an upper bound on the q-th percentile (0 <= q <= 100)."""
+        total = sum(self.counts.values())
+        if total == 0:
+            return None
+        seen = 0
+        for upper, count in self.buckets():
+            seen += count
+            if seen >= q / 100.0 * total:
+                return upper
+        return upper
+
+class CallStats(object):
+    """Call count, total, min and max run time and histogram for a function.
+
+    All times are in nanoseconds.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = None
+        self.histogram = Histogram()
+
+    def record(self, ns):
+        self.count += 1
+        self.total_ns += ns
+        if self.min_ns is None or ns < self.min_ns:
+            self.min_ns = ns
+        if self.max_ns is None or ns > self.max_ns:
+            self.max_ns = ns
+        self.histogram.record(ns)
+
+    def to_dict(self):
+        return {'count': self.count, 'total_ns': self.total_ns,
+            'min_ns': self.min_ns, 'max_ns': self.max_ns,
+            'p50_ns': self.histogram.percentile(50),
+            'p99_ns': self.histogram.percentile(99),
+            'buckets': self.histogram.buckets()}
+
+class MetricsRegistry(object):
+    """Collection of CallStats, keyed by function name."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, ns):
+        """Record one call of function name that took ns nanoseconds."""
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = CallStats()
+            stats.record(ns)
+
+    def get(self, name):
+        """Return the CallStats for name, or None if it was never called."""
+        return self._stats.get(name)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def to_json(self):
+        with self._lock:
+            return json.dumps(dict((name, stats.to_dict())
+                for name, stats in sorted(self._stats.items())), indent=2)
+
+    def to_prometheus(self, metric='function_duration_seconds',
+            bounds=PROMETHEUS_BOUNDS_NS):
+        """Export as Prometheus histograms in the text exposition format.
+
+        The fine buckets of each Histogram are summed into the same fixed
+        bounds (in nanoseconds) for every function; to_json keeps the full
+        resolution.
+        """
+        lines = ['# HELP {} Run time of timed functions.'.format(metric),
+            '# TYPE {} histogram'.format(metric)]
+        with self._lock:
+            for name, stats in sorted(self._stats.items()):
+                label = 'function="{}"'.format(name)
+                cumulative = stats.histogram.cumulative_counts(bounds)
+                for upper, count in zip(bounds, cumulative):
+                    lines.append('{}_bucket{{{},le="{:.9g}"}} {}'.format(
+                        metric, label, upper * 1e-9, count))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(metric,
+                    label, stats.count))
+                lines.append('{}_sum{{{}}} {:.9g}'.format(metric, label,
+                    stats.total_ns * 1e-9))
+                lines.append('{}_count{{{}}} {}'.format(metric, label,
+                    stats.count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write to path as JSON if it ends in .json, else Prometheus text."""
+        with open(path, 'w') as f:
+            f.write(self.to_json() if path.endswith('.json')
+                else self.to_prometheus())
+
+registry = MetricsRegistry()
+
+if os.environ.get('METRICS_EXPORT_FILE'):
+    atexit.register(registry.write, os.environ['METRICS_EXPORT_FILE'])
@@ -0,0 +1,100 @@
+"""Read and write particle snapshots as memory-mapped files.
+
+A snapshot is a directory holding one .npy file per column: x.npy, y.npy,
+z.npy and, for polydisperse particles, radius.npy. Columns are opened with
+np.memmap, so loading a snapshot takes no time and no memory; data is only
+read from disk when a slice of it is used. The distance functions that work
+in chunks (find_neighbors, find_contacts, iter_overlaps and
+find_distances_tiled) accept these arrays directly and never copy a whole
+column into memory.
+"""
+
+import os
+import sys
+import numpy as np
+
+COLUMNS = ('x', 'y', 'z', 'radius')
+
+def create_snapshot(path, num_particles, dtype=np.float32, radius=False):
+    """Create an empty snapshot to be filled in place.
+
+    Args:
+        path: directory to create the snapshot in
+        num_particles: number of particles
+        dtype: NumPy dtype of the stored values; float32 halves the size of
+            the files compared with float64
+        radius: if True, also create a radius column
+
+    Returns:
+        Tuple (x, y, z, radius) of writable np.memmap arrays, with radius
+        None if it was not requested
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    names = COLUMNS if radius else COLUMNS[:3]
+    columns = [np.lib.format.open_memmap(os.path.join(path, name + '.npy'),
+        mode='w+', dtype=dtype, shape=(num_particles,)) for name in names]
+    if not radius:
+        columns.append(None)
+    return tuple(columns)
+
+def save_snapshot(path, x, y, z, radius=None, dtype=np.float32,
+        chunk=1048576):
+    """Save particle coordinates (and radii) as a snapshot.
+
+    Args:
+        path: directory to write the snapshot to
+        x: NumPy array of particle x coordinates
+        y: NumPy array of particle y coordinates
+        z: NumPy array of particle z coordinates
+        radius: optional NumPy array with one radius per particle
+        dtype: NumPy dtype of the stored values
+        chunk: number of values copied at a time
+    """
+    assert len(x) == len(y) == len(z)  # primitive input validation
+
+    columns = create_snapshot(path, len(x), dtype, radius is not None)
+    for source, column in zip((x, y, z, radius), columns):
+        if column is None:
+            continue
+        for start in range(0, len(x), chunk):
+            column[start:start + chunk] = source[start:start + chunk]
+        column.flush()
+
+def load_snapshot(path, mode='r'):
+    """Open a snapshot without reading it into memory.
+
+    Args:
+        path: snapshot directory
+        mode: np.memmap mode; 'r' for read-only, 'r+' to modify in place
+
+    Returns:
+        Tuple (x, y, z, radius) of np.memmap arrays, with radius None if the
+        snapshot has no radius column
+    """
+    columns = []
+    for name in COLUMNS:
+        filename = os.path.join(path, name + '.npy')
+        if name == 'radius' and not os.path.exists(filename):
+            columns.append(None)
+        else:
+            columns.append(np.load(filename, mmap_mode=mode))
+    assert len(columns[0]) == len(columns[1]) == len(columns[2])
+    return tuple(columns)
+
+if __name__ == '__main__':
+    # Write a snapshot of uniformly distributed particles, one chunk at a
+    # time, e.g.: python particle_store.py snapshot 10000000 500.0
+    if len(sys.argv) != 4:
+        sys.exit("usage: python particle_store.py PATH NUM_PARTICLES "
+            "DOMAIN_SIZE")
+    path, num_spheres, domain_size = sys.argv[1], int(sys.argv[2]), \
+        float(sys.argv[3])
+
+    rng = np.random.RandomState(seed=1)
+    chunk = 1048576
+    for column in create_snapshot(path, num_spheres)[:3]:
+        for start in range(0, num_spheres, chunk):
+            stop = min(start + chunk, num_spheres)
+            column[start:stop] = rng.uniform(0, domain_size, stop - start)
+        column.flush()
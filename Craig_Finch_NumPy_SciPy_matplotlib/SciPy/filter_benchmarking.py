@@ -0,0 +1,71 @@
+"""Measure the throughput of StreamingFilter in samples per second.
+
+The long FIR filter is run both in direct form and with FFT overlap-add, and
+the number of taps at which FFTs become faster on this machine is printed
+first.
+
+Example:
+    python filter_benchmarking.py --channels 1 64 --block-sizes 256 4096
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from streaming_filter import (FIRFilter, SOSFilter, StreamingFilter,
+    fir_crossover)
+
+# Filter parameters, as in linear_filters.py
+cutoff = 0.2
+numtaps = 100
+order = 4       # IIR
+long_numtaps = 1000
+
+FILTERS = {
+    'fir': lambda: StreamingFilter.fir(numtaps, cutoff),
+    'butter': lambda: StreamingFilter.butter(order, cutoff),
+    'butter_sos': lambda: SOSFilter.butter(order, cutoff),
+    'fir_long': lambda: FIRFilter.fir(long_numtaps, cutoff, method='direct'),
+    'fir_long_fft': lambda: FIRFilter.fir(long_numtaps, cutoff, method='fft'),
+}
+
+def throughput(make_filter, channels, block_size, num_blocks, repeats=3):
+    """Return the best samples per second (over all channels) of repeats."""
+    rng = np.random.RandomState(seed=1)
+    blocks = rng.normal(size=(num_blocks, channels, block_size))
+    best = 0.0
+    for _ in range(repeats):
+        f = make_filter()
+        t1 = time.perf_counter()
+        for block in blocks:
+            f.process(block)
+        t2 = time.perf_counter()
+        best = max(best, blocks.size / (t2 - t1))
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filters', nargs='+', choices=sorted(FILTERS),
+        default=sorted(FILTERS))
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 64])
+    parser.add_argument('--block-sizes', type=int, nargs='+',
+        default=[64, 1024, 16384])
+    parser.add_argument('--samples', type=int, default=2**20,
+        help='samples per channel to filter (default: 2**20)')
+    args = parser.parse_args(argv)
+
+    print('FFT filtering is faster from {} taps'.format(fir_crossover()))
+    print('{:<12} {:>9} {:>11} {:>16}'.format('filter', 'channels', 'block',
+        'samples/sec'))
+    for name in args.filters:
+        for channels in args.channels:
+            for block_size in args.block_sizes:
+                num_blocks = max(1, args.samples // block_size // channels)
+                rate = throughput(FILTERS[name], channels, block_size,
+                    num_blocks)
+                print('{:<12} {:>9} {:>11} {:>16.3e}'.format(name, channels,
+                    block_size, rate))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Compare convolution and deconvolution methods over signal lengths.
+
+The impulse responses are the first-order system of LTI_simulation.py, a
+moving average (boxcar) and a Gaussian blur. The last two have frequencies
+where they have almost no gain, which makes naive deconvolution blow up.
+For each impulse response and signal length, the response is computed with
+np.convolve and with LTISystem.response(method='fft'), and the input is
+recovered from the noisy response with signal.deconvolve (only for short
+signals, as it is slow and unstable) and with LTISystem's regularized
+deconvolution. Times are the best of several runs; errors are the RMS
+difference from the true input.
+
+Example:
+    python lti_benchmarking.py --lengths 1000 10000 360000
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy import signal
+
+from lti_response import LTISystem
+
+def make_kernel(name, tau):
+    """Return an impulse response of width about tau samples."""
+    if name == 'exponential':
+        t = np.arange(int(10 * tau))
+        return np.exp(-t / tau)
+    if name == 'boxcar':
+        return np.ones(int(2 * tau)) / int(2 * tau)
+    if name == 'gaussian':
+        t = np.arange(-int(3 * tau), int(3 * tau) + 1)
+        h = np.exp(-0.5 * (t / tau)**2)
+        return h / h.sum()
+    raise ValueError('unknown kernel {}'.format(name))
+
+def best_time(func, repeats):
+    """Return the result of func() and its fastest run time in seconds."""
+    times = []
+    for _ in range(repeats):
+        t1 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t1)
+    return result, min(times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', type=int, nargs='+',
+        default=[1000, 10000, 100000],
+        help='signal lengths in samples (default: 1000 10000 100000)')
+    parser.add_argument('--tau', type=float, default=30.0,
+        help='time constant of the system, in samples (default: 30)')
+    parser.add_argument('--kernels', nargs='+',
+        choices=['exponential', 'boxcar', 'gaussian'],
+        default=['exponential', 'boxcar', 'gaussian'],
+        help='impulse responses to try (default: all)')
+    parser.add_argument('--noise', type=float, default=1e-4,
+        help='variance of the noise added to the response (default: 1e-4)')
+    parser.add_argument('--max-direct', type=int, default=20000,
+        help='longest signal for np.convolve and signal.deconvolve '
+        '(default: 20000)')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print('{:<12} {:<22} {:>9} {:>12} {:>12}'.format('kernel', 'method', 'N',
+        'time (s)', 'RMS error'))
+    for kernel in args.kernels:
+        system = LTISystem(make_kernel(kernel, args.tau))
+        rng = np.random.RandomState(seed=1)
+        row = '{:<12} {{:<22}} {{:>9}} {{:>12.6f}} {{:>12}}'.format(kernel)
+        for n in args.lengths:
+            # Random steps, as in the step function of LTI_simulation.py
+            x = np.repeat(rng.uniform(0, 1, n // 100 + 1), 100)[:n]
+            y = system.response(x, method='fft')
+            y_noisy = y + rng.normal(0, np.sqrt(args.noise), len(y))
+
+            def error(x_recovered):
+                # signal.deconvolve can blow up past the float range
+                with np.errstate(over='ignore', invalid='ignore'):
+                    return '{:.3e}'.format(
+                        np.sqrt(np.mean((x_recovered - x)**2)))
+
+            if n <= args.max_direct:
+                _, seconds = best_time(lambda: np.convolve(x, system.h),
+                    args.repeats)
+                print(row.format('np.convolve', n, seconds, ''))
+            _, seconds = best_time(lambda: system.response(x, method='fft'),
+                args.repeats)
+            print(row.format('LTISystem.response', n, seconds, ''))
+
+            if n <= args.max_direct:
+                result, seconds = best_time(lambda: signal.deconvolve(
+                    y_noisy, system.h)[0], args.repeats)
+                print(row.format('signal.deconvolve', n, seconds,
+                    error(result)))
+            result, seconds = best_time(lambda: system.deconvolve(y_noisy,
+                1e-4), args.repeats)
+            print(row.format('tikhonov', n, seconds, error(result)))
+            result, seconds = best_time(lambda: system.wiener_deconvolve(
+                y_noisy, args.noise), args.repeats)
+            print(row.format('wiener', n, seconds, error(result)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Fast response and input recovery for long signals through an LTI system.
+
+LTI_simulation.py computes the response to an input with np.convolve and
+recovers the input with signal.deconvolve. Both take O(N*M) time for a
+signal of N samples and an impulse response of M samples, and
+signal.deconvolve, which is polynomial division, amplifies noise without
+limit for long impulse responses.
+
+LTISystem convolves with FFTs when that is faster, reusing the spectrum of
+the impulse response between calls, and deconvolves in the frequency domain
+with Tikhonov or Wiener regularization, which keeps the noise bounded:
+
+    system = LTISystem(h(h_times, tau))
+    y = system.response(x)
+    x_recovered = system.deconvolve(y + noise)
+"""
+
+import numpy as np
+import scipy.fft
+import scipy.ndimage
+import scipy.signal
+
+class LTISystem(object):
+    """Discrete-time linear time invariant system, given by its impulse
+    response."""
+
+    def __init__(self, h):
+        """Create a system from its impulse response.
+
+        Args:
+            h: 1D NumPy array, impulse response sampled at the time step of
+                the signals
+        """
+        self.h = np.asarray(h, dtype=float)
+        assert self.h.ndim == 1 and len(self.h) > 0
+        self._spectra = {}  # FFT size -> rfft of h
+
+    def spectrum(self, nfft):
+        """Return the rfft of the impulse response zero-padded to nfft.
+
+        Spectra are cached, so filtering many signals of the same length
+        transforms h only once.
+        """
+        if nfft not in self._spectra:
+            self._spectra[nfft] = scipy.fft.rfft(self.h, nfft)
+        return self._spectra[nfft]
+
+    def response(self, x, mode='full', method='auto'):
+        """Return the response of the system to input x.
+
+        Args:
+            x: 1D NumPy array, input signal
+            mode: 'full', 'same' or 'valid', as for np.convolve
+            method: 'direct' for np.convolve, 'fft', or 'auto' to let
+                scipy.signal.choose_conv_method pick the faster one
+
+        Returns:
+            NumPy array, the convolution of x with h
+        """
+        x = np.asarray(x, dtype=float)
+        if method == 'auto':
+            method = scipy.signal.choose_conv_method(x, self.h, mode=mode)
+        if method == 'direct':
+            return np.convolve(x, self.h, mode=mode)
+
+        n = len(x) + len(self.h) - 1
+        nfft = scipy.fft.next_fast_len(n, real=True)
+        y = scipy.fft.irfft(scipy.fft.rfft(x, nfft) * self.spectrum(nfft),
+            nfft)[:n]
+
+        # Trim as np.convolve does
+        if mode == 'same':
+            length = max(len(x), len(self.h))
+            start = (n - length) // 2
+        elif mode == 'valid':
+            length = max(len(x), len(self.h)) - min(len(x), len(self.h)) + 1
+            start = min(len(x), len(self.h)) - 1
+        else:
+            return y
+        return y[start:start + length]
+
+    def _transforms(self, y):
+        """Return FFT size, rfft of y and spectrum of h for deconvolving y."""
+        y = np.asarray(y, dtype=float)
+        assert len(y) >= len(self.h), \
+            "y must be a full response, at least as long as h"
+        # y = h * x has len(y) samples, so this FFT size avoids wrap-around
+        nfft = scipy.fft.next_fast_len(len(y), real=True)
+        return nfft, scipy.fft.rfft(y, nfft), self.spectrum(nfft)
+
+    def deconvolve(self, y, regularization=1e-6):
+        """Recover the input from a full response with Tikhonov regularization.
+
+        Minimizes |h * x - y|**2 + lam * |x|**2, which in the frequency
+        domain is X = conj(H) Y / (|H|**2 + lam). Frequencies where the
+        system has little gain are damped instead of amplified.
+
+        Args:
+            y: 1D NumPy array, full response (mode='full') to the input
+            regularization: lam relative to the largest |H|**2; larger
+                values give a smoother, less noisy but more blurred input
+
+        Returns:
+            NumPy array of len(y) - len(h) + 1 samples, the estimated input
+        """
+        nfft, Y, H = self._transforms(y)
+        power = np.abs(H)**2
+        lam = regularization * power.max()
+        x = scipy.fft.irfft(np.conj(H) * Y / (power + lam), nfft)
+        return x[:len(y) - len(self.h) + 1]
+
+    def wiener_deconvolve(self, y, noise_power, signal_power=None):
+        """Recover the input from a noisy full response with a Wiener filter.
+
+        The Wiener filter X = conj(H) S Y / (|H|**2 S + N) gives the least
+        squares estimate of the input, given the power spectra S of the
+        input and N of the noise. Where the system has little gain,
+        |H|**2 S is small next to N and the filter damps the frequency
+        rather than amplifying it.
+
+        Args:
+            y: 1D NumPy array, full response (mode='full') plus noise
+            noise_power: variance of the (white) noise added to y
+            signal_power: power spectrum of the input, a float or an array
+                of nfft // 2 + 1 values. If None, S is estimated from the
+                smoothed periodogram of y, less the noise, divided by
+                |H|**2. Frequencies where y is not clearly above the noise
+                get S = 0, and S is capped at the level of a white input
+                with the same response power.
+
+        Returns:
+            NumPy array of len(y) - len(h) + 1 samples, the estimated input
+        """
+        nfft, Y, H = self._transforms(y)
+        power = np.abs(H)**2
+        noise = noise_power * nfft  # noise power of each rfft coefficient
+        tiny = np.finfo(float).tiny
+        if signal_power is None:
+            # |H|**2 S + N, averaged over neighboring frequencies so a noise
+            # peak in one bin is not taken for signal
+            observed = scipy.ndimage.uniform_filter1d(np.abs(Y)**2, 9,
+                mode='nearest')
+            response = np.where(observed > 3 * noise, observed - noise, 0.0)
+            # S = response / |H|**2, but no more than cap even where |H| is
+            # nearly zero, which would otherwise amplify the noise there
+            cap = response.sum() / max(power.sum(), tiny)
+            signal = np.minimum(response, cap * power) \
+                / np.maximum(power, tiny)
+        else:
+            signal = np.asarray(signal_power, dtype=float) * nfft
+        X = np.conj(H) * signal * Y / np.maximum(power * signal + noise, tiny)
+        x = scipy.fft.irfft(X, nfft)
+        return x[:len(y) - len(self.h) + 1]
+
+if __name__ == '__main__':
+    # Recover a noisy step through the first-order system of LTI_simulation.py
+    tau = 5.0 * 60
+    dt = 10.0
+    h_times = np.arange(0, 60 * 30.0, dt)
+    h = np.exp(-h_times / tau)
+
+    x = np.zeros(2000)
+    x[500:1500] = 1.0
+    system = LTISystem(h)
+    y = system.response(x)
+
+    rng = np.random.RandomState(seed=1)
+    noise_power = 0.01
+    y_noisy = y + rng.normal(0, np.sqrt(noise_power), len(y))
+
+    for name, x_recovered in [
+            ('tikhonov', system.deconvolve(y_noisy, 1e-3)),
+            ('wiener', system.wiener_deconvolve(y_noisy, noise_power))]:
+        print('{:<9} RMS error {:.4f}'.format(name,
+            np.sqrt(np.mean((x_recovered - x)**2))))
@@ -0,0 +1,298 @@
+"""Filter signals that arrive a block at a time, such as live sensor feeds.
+
+scipy.signal.lfilter can carry the filter state from one call to the next
+through its zi argument. StreamingFilter keeps that state, so filtering a
+signal block by block gives exactly the same output as one lfilter call on
+the whole signal, whatever the block sizes.
+
+FIRFilter does the same for FIR filters, but filters long ones with FFT
+overlap-add, which is much faster than lfilter for hundreds of taps.
+SOSFilter is the IIR counterpart, in second-order sections, which stay
+accurate at high filter orders where (b, a) coefficients do not.
+"""
+
+import numpy as np
+import scipy.fft
+import scipy.signal
+
+class StreamingFilter(object):
+    """Linear filter that keeps its state between blocks of samples.
+
+    Blocks are 1D arrays of samples, or 2D arrays of (channels x samples) to
+    filter many channels at once, each with its own state.
+    """
+
+    def __init__(self, b, a=1.0):
+        """Create a filter from transfer function coefficients.
+
+        Args:
+            b: numerator coefficients (the taps, for an FIR filter)
+            a: denominator coefficients; 1.0 for an FIR filter
+        """
+        self.b = np.atleast_1d(np.asarray(b, dtype=float))
+        self.a = np.atleast_1d(np.asarray(a, dtype=float))
+        self.zi = None  # created to match the first block
+
+    @classmethod
+    def fir(cls, numtaps, cutoff, window='hamming'):
+        """Create a finite impulse response (FIR) filter with firwin."""
+        return cls(scipy.signal.firwin(numtaps, cutoff, window=window))
+
+    @classmethod
+    def butter(cls, order, cutoff, btype='lowpass'):
+        """Create a Butterworth infinite impulse response (IIR) filter."""
+        b, a = scipy.signal.butter(order, cutoff, btype=btype)
+        return cls(b, a)
+
+    @property
+    def order(self):
+        """Number of state values per channel."""
+        return max(len(self.a), len(self.b)) - 1
+
+    def reset(self, channels=None, initial=None):
+        """Clear the filter state.
+
+        Args:
+            channels: number of channels, or None for 1D blocks
+            initial: optional input value (or one per channel) to start
+                from, as if the filter had seen that value forever, like
+                the lfilter_zi example in linear_filters.py. Without it the
+                filter starts from zero.
+        """
+        shape = (self.order,) if channels is None else (channels, self.order)
+        if initial is None:
+            self.zi = np.zeros(shape)
+        else:
+            steady = scipy.signal.lfilter_zi(self.b, self.a)
+            self.zi = np.asarray(initial, dtype=float)[..., np.newaxis] \
+                * steady * np.ones(shape)
+
+    def process(self, block):
+        """Filter the next block of samples.
+
+        Args:
+            block: NumPy array of samples, 1D or (channels x samples)
+
+        Returns:
+            Filtered samples, with the same shape as block
+        """
+        block = np.asarray(block, dtype=float)
+        if self.zi is None:
+            self.reset(None if block.ndim == 1 else block.shape[0])
+        assert self.zi.shape[:-1] == block.shape[:-1], \
+            "block has a different number of channels than earlier blocks"
+        if block.shape[-1] == 0:
+            return block.copy()  # lfilter rejects empty input for FIR filters
+        y, self.zi = scipy.signal.lfilter(self.b, self.a, block, axis=-1,
+            zi=self.zi)
+        return y
+
+class SOSFilter(object):
+    """IIR filter in second-order sections that keeps its state between blocks.
+
+    High-order IIR filters in (b, a) form lose accuracy quickly, as small
+    rounding errors in the coefficients move the poles. A cascade of
+    second-order sections does not have this problem. Like StreamingFilter,
+    SOSFilter takes 1D blocks or (channels x samples) blocks, which are
+    filtered with one sosfilt call however many channels there are.
+    """
+
+    def __init__(self, sos):
+        """Create a filter from second-order sections.
+
+        Args:
+            sos: array of shape (sections, 6), e.g. from
+                scipy.signal.butter(..., output='sos')
+        """
+        self.sos = np.atleast_2d(np.asarray(sos, dtype=float))
+        self.zi = None  # created to match the first block
+
+    @classmethod
+    def butter(cls, order, cutoff, btype='lowpass'):
+        """Create a Butterworth IIR filter in second-order sections."""
+        return cls(scipy.signal.butter(order, cutoff, btype=btype,
+            output='sos'))
+
+    def reset(self, channels=None, initial=None):
+        """Clear the filter state.
+
+        Args:
+            channels: number of channels, or None for 1D blocks
+            initial: optional input value (or one per channel) to start
+                from, as if the filter had seen that value forever. Without
+                it the filter starts from zero.
+        """
+        # sosfilt wants the state as (sections, channels..., 2)
+        sections = len(self.sos)
+        shape = (sections, 2) if channels is None \
+            else (sections, channels, 2)
+        if initial is None:
+            self.zi = np.zeros(shape)
+        else:
+            steady = scipy.signal.sosfilt_zi(self.sos)  # (sections, 2)
+            if channels is not None:
+                steady = steady[:, np.newaxis, :]
+            self.zi = np.asarray(initial, dtype=float)[..., np.newaxis] \
+                * steady * np.ones(shape)
+
+    def process(self, block):
+        """Filter the next block of samples.
+
+        Args:
+            block: NumPy array of samples, 1D or (channels x samples)
+
+        Returns:
+            Filtered samples, with the same shape as block
+        """
+        block = np.asarray(block, dtype=float)
+        if self.zi is None:
+            self.reset(None if block.ndim == 1 else block.shape[0])
+        assert self.zi.shape[1:-1] == block.shape[:-1], \
+            "block has a different number of channels than earlier blocks"
+        if block.shape[-1] == 0:
+            return block.copy()  # sosfilt cannot reshape an empty block
+        y, self.zi = scipy.signal.sosfilt(self.sos, block, axis=-1,
+            zi=self.zi)
+        return y
+
+# Spectra of FIR taps, keyed by (taps, FFT size), shared by all FIRFilters
+_spectra = {}
+
+# Number of taps above which FFT filtering beats lfilter on this machine,
+# measured the first time it is needed
+_crossover = None
+
+def _spectrum(taps, nfft):
+    key = (taps.tobytes(), nfft)
+    if key not in _spectra:
+        _spectra[key] = scipy.fft.rfft(taps, nfft)
+    return _spectra[key]
+
+def fir_crossover(block_size=4096, candidates=(8, 16, 32, 64, 128, 256, 512,
+        1024, 2048), repeats=3):
+    """Find the number of taps at which FFT filtering becomes faster.
+
+    Times direct and FFT filtering of one block for increasing filter
+    lengths. The answer depends on the CPU and the FFT and BLAS libraries,
+    so it is measured rather than guessed, and remembered for FIRFilters
+    created later with method='auto'.
+
+    Returns:
+        Smallest number of taps in candidates for which FFT filtering was
+        faster, or twice the largest candidate if it never was
+    """
+    import time
+
+    global _crossover
+    rng = np.random.RandomState(seed=1)
+    block = rng.normal(size=block_size)
+    _crossover = 2 * candidates[-1]
+    for numtaps in candidates:
+        taps = rng.normal(size=numtaps)
+        best = {}
+        for method in ('direct', 'fft'):
+            f = FIRFilter(taps, method=method)
+            f.process(block)  # warm up, e.g. compute the spectrum
+            times = []
+            for _ in range(repeats):
+                t1 = time.perf_counter()
+                f.process(block)
+                times.append(time.perf_counter() - t1)
+            best[method] = min(times)
+        if best['fft'] < best['direct']:
+            _crossover = numtaps
+            break
+    return _crossover
+
+class FIRFilter(StreamingFilter):
+    """Streaming FIR filter using direct form or FFT overlap-add.
+
+    Direct form (lfilter) costs O(taps) per sample and FFT overlap-add
+    O(log(taps)), so long filters are much faster with FFTs. With
+    method='auto' the choice is made by comparing the number of taps with
+    fir_crossover(). The state carried between blocks is the same for both
+    methods, so the output matches one lfilter call on the whole signal
+    either way.
+    """
+
+    def __init__(self, taps, method='auto'):
+        """Create a filter from its taps.
+
+        Args:
+            taps: FIR filter coefficients, e.g. from scipy.signal.firwin
+            method: 'direct', 'fft', or 'auto' to choose by filter length
+        """
+        StreamingFilter.__init__(self, taps)
+        if method == 'auto':
+            crossover = _crossover if _crossover is not None \
+                else fir_crossover()
+            method = 'fft' if len(self.b) >= crossover else 'direct'
+        assert method in ('direct', 'fft')
+        self.method = method
+
+        # Largest FFT size used: a fast size about 8 times the filter length
+        # keeps the overhead of the overlapping tails small
+        self.nfft = scipy.fft.next_fast_len(8 * len(self.b))
+
+    @classmethod
+    def fir(cls, numtaps, cutoff, window='hamming', method='auto'):
+        """Create a low-pass FIR filter with firwin."""
+        return cls(scipy.signal.firwin(numtaps, cutoff, window=window),
+            method=method)
+
+    def process(self, block):
+        """Filter the next block of samples.
+
+        Args:
+            block: NumPy array of samples, 1D or (channels x samples)
+
+        Returns:
+            Filtered samples, with the same shape as block
+        """
+        if self.method == 'direct':
+            return StreamingFilter.process(self, block)
+
+        block = np.asarray(block, dtype=float)
+        if self.zi is None:
+            self.reset(None if block.ndim == 1 else block.shape[0])
+        assert self.zi.shape[:-1] == block.shape[:-1], \
+            "block has a different number of channels than earlier blocks"
+
+        lead = block.shape[:-1]
+        n = block.shape[-1]
+        m = len(self.b)
+
+        # Each FFT filters a segment of seg samples. Blocks shorter than a
+        # full segment use a smaller FFT, just long enough for the block.
+        nfft = self.nfft
+        if n + m - 1 < nfft:
+            nfft = scipy.fft.next_fast_len(max(n, 1) + m - 1)
+        seg = nfft - m + 1
+        num_segments = max(1, -(-n // seg))  # ceil(n / seg)
+
+        # Transform all segments of the block at once
+        padded = np.zeros(lead + (num_segments * seg,))
+        padded[..., :n] = block
+        segments = padded.reshape(lead + (num_segments, seg))
+        y = scipy.fft.irfft(scipy.fft.rfft(segments, nfft, axis=-1)
+            * _spectrum(self.b, nfft), nfft, axis=-1)
+
+        # Overlap-add: each segment's tail of m - 1 samples is added to the
+        # start of the following segments
+        total = num_segments * seg
+        out = np.zeros(lead + (total + max(seg, m - 1),))
+        out[..., :total] = y[..., :seg].reshape(lead + (total,))
+        if seg >= m - 1:
+            heads = out[..., seg:seg + total].reshape(
+                lead + (num_segments, seg))
+            heads[..., :m - 1] += y[..., seg:]
+        else:
+            # Only possible with a single short segment
+            out[..., seg:seg + m - 1] += y[..., 0, seg:]
+
+        # Add what earlier blocks contribute, and carry this block's tail.
+        # The tail is exactly the zi of lfilter's transposed direct form, so
+        # reset() and the direct method work with it unchanged.
+        out[..., :m - 1] += self.zi
+        self.zi = out[..., n:n + m - 1].copy()
+        return out[..., :n]
@@ -0,0 +1,157 @@
+"""Render frames of a simulation off screen, e.g. to make a movie.
+
+Building a matplotlib figure takes much longer than drawing it, so
+FrameRenderer builds the figure once with the Agg backend, keeps a copy of
+the static background (axes, borders, labels) and only redraws the circles
+for each frame. Frames can be saved as PNG files or returned as RGB arrays,
+and render_frames spreads the work over several processes:
+
+    frames = [(x0, y0), (x1, y1), ...]
+    render_frames(frames, 'frame_{:05d}.png', radius=1.0, width=20.0)
+
+The PNG files can then be combined into a movie with a tool such as ffmpeg.
+"""
+
+import multiprocessing
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import EllipseCollection
+from matplotlib.figure import Figure
+import matplotlib.image
+
+from plot_circles import _draw_domain
+
+class FrameRenderer(object):
+    """Draw circles at new positions, reusing one off-screen figure."""
+
+    def __init__(self, center_x, center_y, radius, width, figsize=(6, 6),
+            dpi=100, color='blue', edgecolor='black'):
+        """Build the figure and draw the static background once.
+
+        Args:
+            center_x: NumPy array, x coordinates of circle centers in the
+                first frame
+            center_y: NumPy array, y coordinates of circle centers in the
+                first frame
+            radius: float, or NumPy array with one radius per circle
+            width: size of plotting area
+            figsize: figure (width, height) in inches
+            dpi: pixels per inch
+            color: matplotlib color of the circles
+            edgecolor: matplotlib color of circle outlines
+        """
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(111)
+        _draw_domain(self.axes, width)
+
+        offsets = np.column_stack((center_x, center_y))
+        diameters = np.broadcast_to(2 * np.asarray(radius, dtype=float),
+            (len(offsets),))
+        self.circles = EllipseCollection(diameters, diameters, 0.0,
+            units='xy', offsets=offsets, offset_transform=self.axes.transData,
+            facecolors=color, edgecolors=edgecolor, animated=True)
+        self.axes.add_collection(self.circles, autolim=False)
+
+        # Borders are drawn again over the circles, as in a normal draw
+        for line in self.axes.lines:
+            line.set_animated(True)
+
+        # Animated artists are left out of a full draw, so this renders and
+        # saves only the background
+        self.canvas.draw()
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def render(self, center_x, center_y):
+        """Draw a frame with the circles moved to new positions."""
+        self.circles.set_offsets(np.column_stack((center_x, center_y)))
+        self.canvas.restore_region(self._background)
+        self.axes.draw_artist(self.circles)
+        for line in self.axes.lines:
+            self.axes.draw_artist(line)
+        return self
+
+    def rgb(self):
+        """Return the current frame as a (height, width, 3) uint8 array."""
+        return np.asarray(self.canvas.buffer_rgba())[:, :, :3].copy()
+
+    def save(self, filename, compress_level=1):
+        """Save the current frame as a PNG file.
+
+        Low compression levels make larger files but save several times
+        faster than the default of 6.
+        """
+        matplotlib.image.imsave(filename,
+            np.asarray(self.canvas.buffer_rgba()), format='png',
+            pil_kwargs={'compress_level': compress_level})
+
+# Renderer of the current worker process, created once by _init_worker
+_renderer = None
+
+def _init_worker(first_frame, radius, width, kwargs):
+    global _renderer
+    _renderer = FrameRenderer(first_frame[0], first_frame[1], radius, width,
+        **kwargs)
+
+def _render_frame(task):
+    index, (center_x, center_y), pattern = task
+    filename = pattern.format(index)
+    _renderer.render(center_x, center_y).save(filename)
+    return filename
+
+def render_frames(frames, pattern, radius, width, processes=None, **kwargs):
+    """Render a sequence of frames to image files.
+
+    Args:
+        frames: sequence of (center_x, center_y) arrays, one per frame
+        pattern: file name pattern with a {} field for the frame number,
+            e.g. 'frame_{:05d}.png'
+        radius: float, or NumPy array with one radius per circle
+        width: size of plotting area
+        processes: number of worker processes, each with its own renderer
+            (default: number of CPUs). Use 1 to render in this process.
+        kwargs: passed on to FrameRenderer
+
+    Returns:
+        List of the file names written, in frame order
+    """
+    frames = list(frames)
+    if not frames:
+        return []
+    tasks = [(i, frame, pattern) for i, frame in enumerate(frames)]
+
+    if processes == 1:
+        _init_worker(frames[0], radius, width, kwargs)
+        return [_render_frame(task) for task in tasks]
+
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+        initargs=(frames[0], radius, width, kwargs))
+    try:
+        # Large chunks keep consecutive frames in the same worker
+        chunksize = max(1, len(tasks) // (4 * (processes or
+            multiprocessing.cpu_count())))
+        return pool.map(_render_frame, tasks, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == '__main__':
+    # Render a short random walk of spheres to PNG files
+    radius = 1.0
+    domain_size = 20.0
+    num_spheres = 15
+    num_frames = 50
+
+    rng = np.random.RandomState(seed=1)
+    x = rng.uniform(0, domain_size, num_spheres)
+    y = rng.uniform(0, domain_size, num_spheres)
+
+    frames = []
+    for _ in range(num_frames):
+        x = x + rng.normal(0, 0.2, num_spheres)
+        y = y + rng.normal(0, 0.2, num_spheres)
+        frames.append((x, y))
+
+    filenames = render_frames(frames, 'frame_{:03d}.png', radius, domain_size)
+    print("Wrote {} frames".format(len(filenames)))
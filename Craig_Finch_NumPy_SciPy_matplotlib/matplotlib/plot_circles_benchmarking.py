@@ -0,0 +1,53 @@
+"""Compare the time to draw many circles with plot_circles (one patch per
+circle) and plot_circles_collection (one collection for all circles).
+
+Example:
+    python plot_circles_benchmarking.py --sizes 100 1000 10000
+"""
+
+import argparse
+import time
+
+import matplotlib
+matplotlib.use('Agg')  # render off screen; nothing is shown
+import matplotlib.pyplot as plt
+import numpy as np
+
+from plot_circles import plot_circles, plot_circles_collection
+
+def time_plot(plot, x, y, radius, width):
+    """Return the seconds taken to build and render a plot."""
+    t1 = time.perf_counter()
+    ax = plot(x, y, radius, width)
+    ax.figure.canvas.draw()
+    t2 = time.perf_counter()
+    plt.close(ax.figure)
+    return t2 - t1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+        default=[100, 1000, 10000], help='numbers of circles to draw')
+    parser.add_argument('--max-patches', type=int, default=10000,
+        help='skip plot_circles above this many circles (default: 10000)')
+    args = parser.parse_args(argv)
+
+    radius = 0.5
+    rng = np.random.RandomState(seed=1)
+
+    print('{:>9} {:>16} {:>16}'.format('circles', 'patches (s)',
+        'collection (s)'))
+    for n in args.sizes:
+        width = np.sqrt(n) * 4 * radius  # keep the density fixed
+        x = rng.uniform(0, width, n)
+        y = rng.uniform(0, width, n)
+        if n <= args.max_patches:
+            patches = '{:16.3f}'.format(time_plot(plot_circles, x, y, radius,
+                width))
+        else:
+            patches = '{:>16}'.format('skipped')
+        collection = time_plot(plot_circles_collection, x, y, radius, width)
+        print('{:>9} {} {:16.3f}'.format(n, patches, collection))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""asyncio versions of Pub and Con, for serving many queues from one process.
+
+Pub and Con use pika.BlockingConnection, so a process handles one queue and
+waits on every network round trip. AsyncPub and AsyncCon use pika's
+AsyncioConnection instead, and any number of them can share one event loop.
+AsyncCon consumes from many queues over one connection, with a channel and
+an async handler per queue, and handles each message in its own task:
+
+    async def demo2(this_list):
+        for item in this_list:
+            print(item)
+
+    async def demo3(this_dict):
+        for key in this_dict:
+            print(key, this_dict[key])
+
+    con = AsyncCon({'hello2': demo2, 'hello3': demo3})
+    asyncio.run(con.run())
+
+AsyncPub publishes to any queue with publisher confirms. publish() returns a
+future that is done when the broker has confirmed the message, and waits
+first if max_in_flight messages are still unconfirmed:
+
+    pub = AsyncPub()
+    await pub.connect()
+    confirmed = [await pub.publish('hello2', body) for body in bodies]
+    await asyncio.gather(*confirmed)
+    await pub.close()
+
+Neither class reconnects: if the connection or a channel is closed, for
+example by the broker, run() and pending publishes raise the reason.
+"""
+__filename__ = 'amqp_asyncio'
+
+import asyncio
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from amqp_codecs import decode_message
+
+
+class _AsyncConnection(object):
+    """Opening and closing a connection, shared by AsyncPub and AsyncCon."""
+
+    def __init__(self, parameters = None,
+                 connection_class = AsyncioConnection):
+        self.parameters = parameters or pika.ConnectionParameters('localhost')
+        self.connection_class = connection_class
+        self.connection = None
+        self._closed = None   # future, done when the connection closes
+        self._waits = set()   # futures of _wait_for calls not yet done
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        opened = loop.create_future()
+        self._closed = loop.create_future()
+
+        def on_open_error(connection, error):
+            opened.set_exception(error)
+
+        def on_close(connection, reason):
+            if not self._closed.done():
+                self._closed.set_result(reason)
+            self._fail(reason)
+
+        self.connection = self.connection_class(self.parameters,
+            on_open_callback = opened.set_result,
+            on_open_error_callback = on_open_error,
+            on_close_callback = on_close,
+            custom_ioloop = loop)
+        await opened
+
+    def _wait_for(self, start):
+        """Call start(callback) and return a future of the callback's
+        argument, which fails instead if _fail is called first.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waits.add(future)
+        future.add_done_callback(self._waits.discard)
+
+        def callback(result):
+            if not future.done():
+                future.set_result(result)
+        start(callback)
+        return future
+
+    async def open_channel(self):
+        return await self._wait_for(lambda callback:
+            self.connection.channel(on_open_callback = callback))
+
+    async def close(self):
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+        if self._closed is not None:
+            await self._closed
+
+    def _fail(self, reason):
+        """Fail everything waiting for the broker, which will not answer."""
+        for future in list(self._waits):
+            if not future.done():
+                future.set_exception(reason)
+
+
+class AsyncPub(_AsyncConnection):
+
+    def __init__(self, parameters = None, max_in_flight = 1000,
+                 connection_class = AsyncioConnection):
+        """Set up the publisher; call connect() before publishing.
+
+        Args:
+            parameters: pika.ConnectionParameters (default: localhost)
+            max_in_flight: most messages waiting for their confirm
+            connection_class: AsyncioConnection, or a stand-in with the same
+                interface (see amqp_standin.py)
+        """
+        _AsyncConnection.__init__(self, parameters, connection_class)
+        self.max_in_flight = max_in_flight
+        self.channel = None
+        self._declared = set()
+        self._delivery_tag = 0
+        self._unconfirmed = {}   # delivery tag -> future
+        self._slots = None
+
+    async def connect(self):
+        await _AsyncConnection.connect(self)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self.channel = await self.open_channel()
+        self.channel.add_on_close_callback(self._on_channel_closed)
+        await self._wait_for(lambda callback:
+            self.channel.confirm_delivery(self._on_confirm, callback))
+
+    async def declare(self, queue):
+        if queue not in self._declared:
+            await self._wait_for(lambda callback:
+                self.channel.queue_declare(queue = queue, callback = callback))
+            self._declared.add(queue)
+
+    async def publish(self, queue, body, properties = None):
+        """Publish body to queue.
+
+        Returns:
+            future that is done (with result True) when the message has
+            been confirmed
+        """
+        await self.declare(queue)
+        await self._slots.acquire()
+        try:
+            self.channel.basic_publish(exchange = '', routing_key = queue,
+                body = body, properties = properties)
+        except Exception:
+            self._slots.release()
+            raise
+        confirmed = asyncio.get_running_loop().create_future()
+        confirmed.add_done_callback(lambda future: self._slots.release())
+        self._delivery_tag += 1
+        self._unconfirmed[self._delivery_tag] = confirmed
+        return confirmed
+
+    async def close(self):
+        """Wait for outstanding confirms, then close the connection."""
+        if self._unconfirmed:
+            await asyncio.gather(*self._unconfirmed.values(),
+                return_exceptions = True)
+        await _AsyncConnection.close(self)
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = [tag for tag in self._unconfirmed
+                if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        for tag in tags:
+            future = self._unconfirmed.pop(tag, None)
+            if future is None or future.done():
+                continue
+            if acked:
+                future.set_result(True)
+            else:
+                future.set_exception(pika.exceptions.NackError([tag]))
+
+    def _on_channel_closed(self, channel, reason):
+        # Messages not confirmed on this channel never will be
+        self._fail(reason)
+
+    def _fail(self, reason):
+        _AsyncConnection._fail(self, reason)
+        for future in self._unconfirmed.values():
+            if not future.done():
+                future.set_exception(reason)
+        self._unconfirmed.clear()
+
+
+class AsyncCon(_AsyncConnection):
+
+    def __init__(self, handlers, parameters = None, prefetch_count = 10,
+                 decoder = None, connection_class = AsyncioConnection):
+        """Set up the consumer; call run() to start.
+
+        Args:
+            handlers: dict of queue name -> async function, called with
+                each decoded message from that queue
+            parameters: pika.ConnectionParameters (default: localhost)
+            prefetch_count: most unacknowledged messages per queue, which is
+                also the most handlers running at once for a queue
+            decoder: function turning a message body into handler input;
+                by default, the codec named in its content_type
+            connection_class: AsyncioConnection, or a stand-in with the same
+                interface (see amqp_standin.py)
+        """
+        _AsyncConnection.__init__(self, parameters, connection_class)
+        self.handlers = handlers
+        self.prefetch_count = prefetch_count
+        self.decoder = decoder
+        self.processed = 0
+        self.failed = 0
+        self._consumers = []   # (channel, consumer tag)
+        self._tasks = set()
+        self._error = None     # reason a channel was closed by the broker
+
+    async def run(self):
+        """Consume from all queues until stop() is called."""
+        await self.connect()
+        try:
+            await asyncio.gather(*[self._consume(queue, handler)
+                for queue, handler in self.handlers.items()])
+        except Exception:
+            await self.close()
+            raise
+        reason = await self._closed
+        if self._error is not None:
+            raise self._error
+        if not isinstance(reason, pika.exceptions.ConnectionClosedByClient):
+            raise reason
+
+    async def _consume(self, queue, handler):
+        channel = await self.open_channel()
+        channel.add_on_close_callback(self._on_channel_closed)
+        await self._wait_for(lambda callback: channel.basic_qos(
+            prefetch_count = self.prefetch_count, callback = callback))
+        await self._wait_for(lambda callback: channel.queue_declare(
+            queue = queue, callback = callback))
+
+        def on_message(channel, method, properties, body):
+            task = asyncio.ensure_future(self._handle(handler, channel,
+                method, properties, body))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        self._consumers.append((channel,
+            channel.basic_consume(queue, on_message)))
+
+    def _on_channel_closed(self, channel, reason):
+        if isinstance(reason, (pika.exceptions.ChannelClosedByClient,
+                               pika.exceptions.ConnectionClosed)):
+            return   # closed by us, or along with the connection
+        # Stop everything, so run() raises the reason instead of serving
+        # the other queues while this one is silently dropped
+        self._error = reason
+        self._fail(reason)
+        if self.connection.is_open:
+            self.connection.close()
+
+    async def _handle(self, handler, channel, method, properties, body):
+        try:
+            if self.decoder is None:
+                message = decode_message(body, properties)
+            else:
+                message = self.decoder(body)
+            await handler(message)
+        except Exception:
+            self.failed += 1
+            if channel.is_open:
+                channel.basic_nack(method.delivery_tag,
+                    requeue = not method.redelivered)
+        else:
+            self.processed += 1
+            if channel.is_open:
+                channel.basic_ack(method.delivery_tag)
+
+    async def stop(self):
+        """Stop consuming, let running handlers finish, and disconnect."""
+        for channel, consumer_tag in self._consumers:
+            if channel.is_open:
+                await self._wait_for(lambda callback:
+                    channel.basic_cancel(consumer_tag, callback))
+        self._consumers = []
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions = True)
+        await self.close()
+
+
+if __name__ == '__main__':
+    # The three demo queues of amqp_consumer.py, served by one process
+    async def demo1(message):
+        print('Received a message: {0}'.format(message))
+
+    async def demo2(this_list):
+        for item in this_list:
+            print(item)
+
+    async def demo3(this_dict):
+        for key in this_dict:
+            print(key, this_dict[key])
+
+    con = AsyncCon({'hello1': demo1, 'hello2': demo2, 'hello3': demo3})
+    asyncio.run(con.run())
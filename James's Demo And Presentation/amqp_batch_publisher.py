@@ -0,0 +1,241 @@
+"""Long-lived AMQP publisher for high message rates.
+
+Pub in amqp_publisher.py opens a connection, publishes one message and
+closes the connection again, so every message pays for a TCP and AMQP
+handshake. BatchPub keeps one connection and channel open, runs pika's
+asynchronous SelectConnection in a background thread and publishes messages
+in batches, one loop iteration (and one socket write) per batch:
+
+    pub = BatchPub(queue = 'hello2')
+    for line in sys.stdin:
+        pub.publish(*encode_message(line.split()))
+    pub.close()
+
+Publisher confirms are handled asynchronously. At most max_in_flight
+messages can be waiting for their confirm; publish() blocks when that many
+are, which limits memory use and passes backpressure on to the caller. If the
+connection is lost, BatchPub reconnects and publishes the unconfirmed
+messages again, so every message arrives at least once.
+"""
+__filename__ = 'amqp_batch_publisher'
+
+import collections
+import threading
+import time
+
+import pika
+
+
+class BatchPub(object):
+
+    def __init__(self, queue = 'hello1', parameters = None, batch_size = 100,
+                 max_in_flight = 1000, flush_interval = 0.05,
+                 reconnect_delay = 1.0,
+                 connection_class = pika.SelectConnection):
+        """Connect in the background and get ready to publish.
+
+        Args:
+            queue: name of the queue to publish to
+            parameters: pika.ConnectionParameters (default: localhost)
+            batch_size: messages collected before they are published
+            max_in_flight: most messages published or waiting to be
+                published that have not been confirmed yet
+            flush_interval: seconds after which an incomplete batch is
+                published anyway
+            reconnect_delay: seconds to wait before reconnecting
+            connection_class: pika.SelectConnection, or a stand-in with the
+                same interface (see amqp_standin.py)
+        """
+        self.queue = queue
+        self.parameters = parameters or pika.ConnectionParameters('localhost')
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.flush_interval = flush_interval
+        self.reconnect_delay = reconnect_delay
+        self.connection_class = connection_class
+
+        self.connection = None
+        self.channel = None
+        self.published = 0    # basic_publish calls, including resends
+        self.confirmed = 0
+        self.nacked = 0
+        self.reconnects = 0
+
+        # _cond guards _pending and _in_flight, which are shared with the
+        # caller's thread. Everything else belongs to the I/O thread.
+        self._cond = threading.Condition()
+        self._pending = []           # (body, properties) of the next batch
+        self._in_flight = 0          # messages accepted but not confirmed
+        self._outbox = collections.deque()   # batches ready to publish
+        self._unconfirmed = collections.OrderedDict()  # tag -> message
+        self._delivery_tag = 0
+        self._closing = False
+
+        self._thread = threading.Thread(target = self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def publish(self, body, properties = None):
+        """Queue one message, blocking while max_in_flight are unconfirmed.
+        """
+        with self._cond:
+            blocked = self._in_flight >= self.max_in_flight
+        if blocked:
+            self.flush()  # don't sit on a partial batch while waiting
+        with self._cond:
+            while self._in_flight >= self.max_in_flight:
+                self._cond.wait()
+            self._in_flight += 1
+            self._pending.append((body, properties))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Publish the messages collected so far without waiting."""
+        self._take_batch()
+        connection = self.connection
+        if connection is not None:
+            try:
+                connection.ioloop.add_callback_threadsafe(self._drain)
+            except Exception:
+                pass  # connection is going away; the next one drains _outbox
+
+    def wait_for_confirms(self, timeout = None):
+        """Flush, then wait until every message has been confirmed.
+
+        Returns:
+            True if all messages were confirmed, False on timeout
+        """
+        self.flush()
+        with self._cond:
+            return self._cond.wait_for(lambda: self._in_flight == 0, timeout)
+
+    def close(self, timeout = None):
+        """Wait for outstanding confirms, then close the connection."""
+        confirmed = self.wait_for_confirms(timeout)
+        self._closing = True
+        connection = self.connection
+        if connection is not None:
+            connection.ioloop.add_callback_threadsafe(self._close_connection)
+        self._thread.join(timeout)
+        return confirmed
+
+    def _take_batch(self):
+        with self._cond:
+            batch, self._pending = self._pending, []
+        if batch:
+            self._outbox.append(batch)
+
+    # The rest runs in the I/O thread
+
+    def _run(self):
+        while not self._closing:
+            self.connection = self.connection_class(self.parameters,
+                on_open_callback = self._on_connection_open,
+                on_open_error_callback = self._on_connection_error,
+                on_close_callback = self._on_connection_closed)
+            self.connection.ioloop.start()
+            if not self._closing:
+                self.reconnects += 1
+                time.sleep(self.reconnect_delay)
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback = self._on_channel_open)
+
+    def _on_connection_error(self, connection, error):
+        connection.ioloop.stop()  # _run reconnects
+
+    def _on_connection_closed(self, connection, reason):
+        self.channel = None
+        connection.ioloop.stop()  # _run reconnects unless closing
+
+    def _close_connection(self):
+        if self.connection.is_open:
+            self.connection.close()
+        else:
+            self.connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(self._on_confirm,
+            callback = lambda frame: channel.queue_declare(queue = self.queue,
+                callback = self._on_queue_declared))
+
+    def _on_channel_closed(self, channel, reason):
+        self.channel = None
+        if not self._closing and self.connection.is_open:
+            self.connection.close()
+
+    def _on_queue_declared(self, frame):
+        # Delivery tags start again on a new channel. Messages not confirmed
+        # on the old one are published again, ahead of newer ones.
+        self._delivery_tag = 0
+        if self._unconfirmed:
+            self._outbox.appendleft(list(self._unconfirmed.values()))
+            self._unconfirmed.clear()
+        self._drain()
+        self._on_timer()
+
+    def _on_timer(self):
+        if self.channel is None:
+            return
+        self._take_batch()
+        self._drain()
+        self.connection.ioloop.call_later(self.flush_interval, self._on_timer)
+
+    def _drain(self):
+        channel = self.channel
+        if channel is None or not channel.is_open:
+            return
+        while self._outbox:
+            for body, properties in self._outbox.popleft():
+                channel.basic_publish(exchange = '', routing_key = self.queue,
+                    body = body, properties = properties)
+                self._delivery_tag += 1
+                self._unconfirmed[self._delivery_tag] = (body, properties)
+                self.published += 1
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = []
+            for tag in self._unconfirmed:
+                if tag > method.delivery_tag:
+                    break
+                tags.append(tag)
+        else:
+            tags = [method.delivery_tag]
+
+        done = 0
+        retry = []
+        for tag in tags:
+            message = self._unconfirmed.pop(tag, None)
+            if message is None:
+                continue
+            if isinstance(method, pika.spec.Basic.Nack):
+                retry.append(message)  # still in flight
+            else:
+                done += 1
+        if retry:
+            self.nacked += len(retry)
+            self._outbox.append(retry)
+            self._drain()
+        if done:
+            with self._cond:
+                self.confirmed += done
+                self._in_flight -= done
+                self._cond.notify_all()
+
+if __name__ == '__main__':
+    import sys
+
+    from amqp_codecs import encode_message
+
+    app = BatchPub(queue = 'hello2')
+    for i in range(10000):
+        app.publish(*encode_message(sys.argv + [str(i)]))
+    app.close()
+    print('Sent {0} messages, {1} confirmed'.format(app.published,
+        app.confirmed))
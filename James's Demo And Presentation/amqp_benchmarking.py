@@ -0,0 +1,142 @@
+"""Measure publisher and consumer throughput in messages per second.
+
+Runs BatchPub with a range of batch sizes and in-flight limits, or with
+--consume, PoolCon with a range of worker and prefetch counts and a handler
+that sleeps for --work seconds per message. By default it uses the
+in-process stand-in broker of amqp_standin.py, with a simulated network
+round trip of --latency seconds, so it runs anywhere; use --host to use a
+real RabbitMQ server instead. Batch size 1 with one message in flight waits
+for each confirm, much like the old Pub.
+
+Examples:
+    python amqp_benchmarking.py --batch-sizes 1 100 --max-in-flight 1 1000
+    python amqp_benchmarking.py --consume --workers 1 8 --prefetch 1 100
+"""
+__filename__ = 'amqp_benchmarking'
+
+import argparse
+import functools
+import threading
+import time
+
+import pika
+
+from amqp_batch_publisher import BatchPub
+from amqp_pool_consumer import PoolCon
+from amqp_standin import StandInBroker, StandInConnection
+
+
+def publisher_throughput(make_publisher, num_messages, body):
+    """Return messages per second, from the first publish to the last confirm.
+    """
+    pub = make_publisher()
+    t1 = time.perf_counter()
+    for _ in range(num_messages):
+        pub.publish(body)
+    pub.close()
+    t2 = time.perf_counter()
+    assert pub.confirmed == num_messages
+    return num_messages / (t2 - t1)
+
+
+def consumer_throughput(make_consumer, num_messages):
+    """Return messages per second handled and acknowledged by a consumer.
+
+    The queue must already hold num_messages messages.
+    """
+    con = make_consumer()
+
+    def stop_when_done():
+        while con.processed < num_messages:
+            time.sleep(0.001)
+        con.stop()
+    threading.Thread(target = stop_when_done).start()
+
+    t1 = time.perf_counter()
+    con.receive_messages()
+    t2 = time.perf_counter()
+    return num_messages / (t2 - t1), con.ack_frames
+
+
+def consume(args, parameters, connection_class):
+    def handler(message):
+        time.sleep(args.work)
+
+    print('{0:>8} {1:>9} {2:>14} {3:>11}'.format('workers', 'prefetch',
+        'messages/sec', 'ack frames'))
+    for prefetch in args.prefetch:
+        for workers in args.workers:
+            # Fill the queue first
+            num_messages = min(args.messages, int(5 * workers / args.work)) \
+                if args.work else args.messages
+            pub = BatchPub(queue = args.queue, parameters = parameters,
+                batch_size = 1000, max_in_flight = 10000,
+                connection_class = connection_class)
+            for _ in range(num_messages):
+                pub.publish(b'0')
+            pub.close()
+
+            make_consumer = functools.partial(PoolCon, queue = args.queue,
+                handler = handler, parameters = parameters,
+                prefetch_count = prefetch, workers = workers,
+                connection_class = connection_class)
+            rate, ack_frames = consumer_throughput(make_consumer,
+                num_messages)
+            print('{0:>8} {1:>9} {2:>14.0f} {3:>11}'.format(workers, prefetch,
+                rate, ack_frames))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--host', help = 'RabbitMQ server to use '
+        '(default: the stand-in broker)')
+    parser.add_argument('--latency', type = float, default = 0.0005,
+        help = 'round trip time of the stand-in broker (default: 0.0005 s)')
+    parser.add_argument('--queue', default = 'benchmark')
+    parser.add_argument('--messages', type = int, default = 20000)
+    parser.add_argument('--size', type = int, default = 100,
+        help = 'message size in bytes (default: 100)')
+    parser.add_argument('--batch-sizes', type = int, nargs = '+',
+        default = [1, 10, 100, 1000])
+    parser.add_argument('--max-in-flight', type = int, nargs = '+',
+        default = [1, 100, 10000])
+    parser.add_argument('--consume', action = 'store_true',
+        help = 'benchmark PoolCon instead of BatchPub')
+    parser.add_argument('--workers', type = int, nargs = '+',
+        default = [1, 4, 16])
+    parser.add_argument('--prefetch', type = int, nargs = '+',
+        default = [1, 10, 100])
+    parser.add_argument('--work', type = float, default = 0.001,
+        help = 'seconds each message takes to handle (default: 0.001)')
+    args = parser.parse_args(argv)
+
+    if args.host:
+        connection_class = pika.SelectConnection
+        parameters = pika.ConnectionParameters(args.host)
+    else:
+        connection_class = functools.partial(StandInConnection,
+            broker = StandInBroker(latency = args.latency))
+        parameters = None
+
+    if args.consume:
+        consume(args, parameters, connection_class)
+        return
+
+    body = b'x' * args.size
+    print('{0:>10} {1:>14} {2:>14}'.format('batch', 'max in flight',
+        'messages/sec'))
+    for max_in_flight in args.max_in_flight:
+        for batch_size in args.batch_sizes:
+            make_publisher = functools.partial(BatchPub, queue = args.queue,
+                parameters = parameters, batch_size = batch_size,
+                max_in_flight = max_in_flight,
+                connection_class = connection_class)
+            # Fewer messages when every one waits for a round trip
+            num_messages = min(args.messages, 1000 * max_in_flight)
+            rate = publisher_throughput(make_publisher, num_messages, body)
+            print('{0:>10} {1:>14} {2:>14.0f}'.format(batch_size,
+                max_in_flight, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Compare message codecs by encode and decode speed and body size.
+
+Each payload is encoded and decoded with every available codec, with and
+without compression, and the rates are the best of several repeats. The
+payloads are a list of strings like the one Pub sends from sys.argv, a dict
+of them, and a list of numeric records, which StructCodec packs as
+(uint32, int64, float64) structs. Bodies smaller than --threshold are
+never compressed, so they only get an uncompressed row.
+
+Example:
+    python amqp_codec_benchmarking.py --records 10 1000
+"""
+__filename__ = 'amqp_codec_benchmarking'
+
+import argparse
+import random
+import time
+
+import amqp_codecs
+
+
+def make_payloads(num_records, seed = 1):
+    """Return a dict of payload name -> (payload, codecs to try)."""
+    rng = random.Random(seed)
+    words = ['word{0}'.format(rng.randint(0, 1000))
+        for _ in range(num_records)]
+    records = [(i, rng.randint(-2**40, 2**40), rng.random())
+        for i in range(num_records)]
+    generic = [name for name in ('json', 'msgpack')
+        if name in amqp_codecs.CODECS]
+    return {
+        'list': (words, generic),
+        'dict': (dict(enumerate(words)), generic),
+        'records': (records, generic + [amqp_codecs.StructCodec('<Iqd')]),
+    }
+
+
+def best_rate(func, arg, repeats, number):
+    """Return calls per second of func(arg), the best of repeats."""
+    best = 0.0
+    for _ in range(repeats):
+        t1 = time.perf_counter()
+        for _ in range(number):
+            func(arg)
+        t2 = time.perf_counter()
+        best = max(best, number / (t2 - t1))
+    return best
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--records', type = int, nargs = '+',
+        default = [10, 1000], help = 'items per payload (default: 10 1000)')
+    parser.add_argument('--compression', nargs = '+',
+        default = [None] + sorted(amqp_codecs.COMPRESSIONS),
+        help = 'compressions to try, or none (default: none and all '
+        'available)')
+    parser.add_argument('--threshold', type = int, default = 1024,
+        help = 'smallest body that gets compressed (default: 1024)')
+    parser.add_argument('--repeats', type = int, default = 3)
+    parser.add_argument('--seconds', type = float, default = 0.1,
+        help = 'rough time per measurement (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    print('{0:<8} {1:>7} {2:<32} {3:<5} {4:>8} {5:>12} {6:>12}'.format(
+        'payload', 'items', 'codec', 'comp', 'bytes', 'encode/s',
+        'decode/s'))
+    for num_records in args.records:
+        for name, (payload, codecs) in sorted(make_payloads(
+                num_records).items()):
+            for codec in codecs:
+                codec = amqp_codecs.get_codec(codec)
+                for compression in args.compression:
+                    if compression == 'none':
+                        compression = None
+
+                    def encode(obj):
+                        return amqp_codecs.encode(obj, codec, compression,
+                            args.threshold)
+                    body, content_type, content_encoding = encode(payload)
+                    if compression is not None and content_encoding is None:
+                        continue   # below threshold, same as uncompressed
+
+                    def decode(body):
+                        return amqp_codecs.decode(body, content_type,
+                            content_encoding)
+
+                    # Enough calls to take about args.seconds
+                    t1 = time.perf_counter()
+                    encode(payload)
+                    decode(body)
+                    number = max(1, int(args.seconds
+                        / max(time.perf_counter() - t1, 1e-7)))
+
+                    print('{0:<8} {1:>7} {2:<32} {3:<5} {4:>8} {5:>12.0f} '
+                        '{6:>12.0f}'.format(name, num_records,
+                        codec.content_type, content_encoding or '-',
+                        len(body), best_rate(encode, payload, args.repeats,
+                            number),
+                        best_rate(decode, body, args.repeats, number)))
+
+if __name__ == '__main__':
+    main()
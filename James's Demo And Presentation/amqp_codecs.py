@@ -0,0 +1,243 @@
+"""Message codecs shared by the publishers and consumers in this directory.
+
+A codec turns Python objects into message bodies and back. The publisher
+names the codec in the message's content_type property, and compression, if
+any, in content_encoding, so consumers pick the right decoder on their own:
+
+    body, properties = encode_message(['a', 'b'], codec = 'msgpack',
+                                      compression = 'zlib')
+    channel.basic_publish(exchange = '', routing_key = 'hello2',
+                          body = body, properties = properties)
+    ...
+    this_list = decode_message(body, properties)
+
+Codecs:
+    json     application/json, the default, readable and universal
+    msgpack  application/msgpack, smaller and faster (needs msgpack)
+    text     text/plain, a UTF-8 string
+    struct   application/x-struct;format=<fmt>, a list of tuples packed with
+             struct.pack(fmt), compact and exact for fixed-layout records,
+             e.g. StructCodec('<Iqd')
+
+A batch of records can be sent as one message with BatchCodec, whose
+content type application/x-batch;codec=<content type> names the codec of
+the records inside. Decoding a batch gives an iterator over its records (see
+amqp_envelope.py).
+
+Compression (zlib, or lz4 if the lz4 package is installed) is only applied
+to bodies of at least threshold bytes, because it makes small bodies bigger
+and costs more time than it saves. Messages without a content_type are
+decoded as JSON, as Pub and Con always used.
+"""
+__filename__ = 'amqp_codecs'
+
+import itertools
+import json
+import struct
+import zlib
+
+import pika
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+class JSONCodec(object):
+    content_type = 'application/json'
+
+    def encode(self, obj):
+        return json.dumps(obj, separators = (',', ':')).encode('utf-8')
+
+    def decode(self, body):
+        return json.loads(body.decode('utf-8'))
+
+
+class MsgpackCodec(object):
+    content_type = 'application/msgpack'
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type = True)
+
+    def decode(self, body):
+        return msgpack.unpackb(body, raw = False, strict_map_key = False)
+
+
+class TextCodec(object):
+    content_type = 'text/plain'
+
+    def encode(self, obj):
+        return obj.encode('utf-8')
+
+    def decode(self, body):
+        return body.decode('utf-8')
+
+
+class StructCodec(object):
+    """Codec for lists of records, each a tuple packed with one struct format.
+    """
+
+    def __init__(self, format):
+        self.struct = struct.Struct(format)
+        self.content_type = 'application/x-struct;format={0}'.format(format)
+        # Without alignment, n records pack like one struct of the format
+        # repeated n times, which is about twice as fast as packing each
+        if format[:1] in ('<', '>', '!', '='):
+            self._order, self._fields = format[0], format[1:]
+        else:
+            self._order = None
+
+    def encode(self, records):
+        if self._order is None:
+            pack = self.struct.pack
+            return b''.join([pack(*record) for record in records])
+        records = list(records)
+        return struct.pack(self._order + self._fields * len(records),
+            *itertools.chain.from_iterable(records))
+
+    def decode(self, body):
+        if len(body) % self.struct.size:
+            raise ValueError('body of {0} bytes is not a whole number of '
+                '{1}-byte records'.format(len(body), self.struct.size))
+        return list(self.struct.iter_unpack(body))
+
+
+class BatchCodec(object):
+    """Codec for a batch of records, each encoded with an inner codec.
+
+    Each record is framed with its length as a 4-byte big-endian integer,
+    so records can be encoded one at a time as they arrive, and decoding
+    returns an iterator that decodes each record only when it is reached.
+    """
+
+    _length = struct.Struct('>I')
+
+    def __init__(self, codec = 'json'):
+        self.codec = get_codec(codec)
+        self.content_type = 'application/x-batch;codec={0}'.format(
+            self.codec.content_type)
+
+    def frame(self, encoded):
+        """Return the body for a list of records already encoded."""
+        pack = self._length.pack
+        return b''.join([pack(len(record)) + record for record in encoded])
+
+    def encode(self, records):
+        return self.frame([self.codec.encode(record) for record in records])
+
+    def decode(self, body):
+        return self._records(memoryview(body))
+
+    def _records(self, body):
+        decode = self.codec.decode
+        unpack = self._length.unpack_from
+        position = 0
+        while position < len(body):
+            length, = unpack(body, position)
+            position += 4
+            if position + length > len(body):
+                raise ValueError('truncated batch')
+            yield decode(body[position:position + length].tobytes())
+            position += length
+
+
+CODECS = {'json': JSONCodec(), 'text': TextCodec()}
+if msgpack is not None:
+    CODECS['msgpack'] = MsgpackCodec()
+
+# content_encoding -> (compress, decompress). zlib level 1 is the fastest,
+# and compresses message bodies almost as well as the default level.
+COMPRESSIONS = {
+    'zlib': (lambda body: zlib.compress(body, 1), zlib.decompress),
+}
+if lz4 is not None:
+    COMPRESSIONS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+
+_struct_codecs = {}  # format -> StructCodec, for decoding
+_batch_codecs = {}   # inner content type -> BatchCodec, for decoding
+
+
+def get_codec(codec):
+    """Return a codec given a name from CODECS, a content type or a codec."""
+    if not isinstance(codec, str):
+        return codec
+    if codec in CODECS:
+        return CODECS[codec]
+    content_type, _, parameters = codec.partition(';')
+    content_type = content_type.strip()
+    if content_type == 'application/x-batch':
+        # The parameter is a content type, maybe with parameters of its own
+        inner = parameters.strip()
+        if not inner.startswith('codec='):
+            raise ValueError('no codec for the records in {0!r}'.format(
+                codec))
+        inner = inner[len('codec='):]
+        if inner not in _batch_codecs:
+            _batch_codecs[inner] = BatchCodec(inner)
+        return _batch_codecs[inner]
+    if content_type == 'application/x-struct':
+        format = dict(parameter.strip().split('=', 1)
+            for parameter in parameters.split(';') if parameter)['format']
+        if format not in _struct_codecs:
+            _struct_codecs[format] = StructCodec(format)
+        return _struct_codecs[format]
+    for known in CODECS.values():
+        if known.content_type == content_type:
+            return known
+    raise ValueError('no codec for {0!r}'.format(codec))
+
+
+def encode(obj, codec = 'json', compression = None, threshold = 1024):
+    """Encode obj for a message body.
+
+    Args:
+        obj: object to encode, of a type the codec supports
+        codec: name from CODECS, content type, or codec object
+        compression: None, or a name from COMPRESSIONS
+        threshold: smallest body size in bytes that gets compressed
+
+    Returns:
+        (body, content_type, content_encoding), where content_encoding is
+        None if the body was not compressed
+    """
+    codec = get_codec(codec)
+    body = codec.encode(obj)
+    content_encoding = None
+    if compression is not None:
+        if compression not in COMPRESSIONS:
+            raise ValueError('unknown or unavailable compression {0!r}'.format(
+                compression))
+        if len(body) >= threshold:
+            body = COMPRESSIONS[compression][0](body)
+            content_encoding = compression
+    return body, codec.content_type, content_encoding
+
+
+def decode(body, content_type = None, content_encoding = None):
+    """Decode a message body encoded by encode()."""
+    if content_encoding:
+        if content_encoding not in COMPRESSIONS:
+            raise ValueError('unknown or unavailable compression {0!r}'.format(
+                content_encoding))
+        body = COMPRESSIONS[content_encoding][1](body)
+    return get_codec(content_type or 'json').decode(body)
+
+
+def encode_message(obj, codec = 'json', compression = None,
+                   threshold = 1024):
+    """Like encode(), but return (body, pika.BasicProperties)."""
+    body, content_type, content_encoding = encode(obj, codec, compression,
+        threshold)
+    return body, pika.BasicProperties(content_type = content_type,
+        content_encoding = content_encoding)
+
+
+def decode_message(body, properties):
+    """Decode a message body, using the codec named in its properties."""
+    return decode(body, properties.content_type, properties.content_encoding)
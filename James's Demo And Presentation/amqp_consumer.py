@@ -1,11 +1,11 @@
 __filename__ = 'amqp_consumer'
 __author__ = 'jwestover@sonobi.com'
 
-
 import pika
-import json
 import sys
 
+from amqp_codecs import decode_message
+
 class Con(object):
 
     def __init__(self, jsonify = False, dict_input = False):
@@ -23,29 +23,30 @@ class Con(object):
 
     def receive_messages(self):
 
-        print 'Listening for Messages'
+        print('Listening for Messages')
 
-        self.channel.basic_consume(self.callback,
-                              queue = self.queue,
-                              no_ack = True)
+        self.channel.basic_consume(queue = self.queue,
+                              on_message_callback = self.callback,
+                              auto_ack = True)
+        self.channel.start_consuming()
 
 
     def callback(self, ch, method, properties, body):
-        print 'Received a message: {0}'.format(body)
+        # Pick the decoder from the content_type set by Pub
+        message = decode_message(body, properties)
+        print('Received a message: {0}'.format(message))
         if self.queue == 'hello2':
-            self.demo2(body)
+            self.demo2(message)
         elif self.queue =='hello3':
-            self.demo3(body)
+            self.demo3(message)
     def demo2(self, this_list):
-        this_list = json.loads(this_list)
         for item in this_list:
-            print item
+            print(item)
 
 
     def demo3(self, this_list):
-        this_list = json.loads(this_list)
         for key in this_list:
-            print key, this_list[key]
+            print(key, this_list[key])
         
 if __name__ == '__main__':
     app = Con(jsonify = True, dict_input = True)
@@ -0,0 +1,307 @@
+"""Send many small records per message, and receive them one at a time.
+
+For small records, the broker round trip and frame overhead of a message
+cost far more than the record itself. RecordBatcher collects records and
+publishes them together as one message, encoded with BatchCodec from
+amqp_codecs.py. A batch is sent when it reaches max_records records or
+max_bytes bytes, or linger seconds after its first record arrived,
+whichever comes first, so a slow trickle of records is not held back for
+long:
+
+    pub = BatchPub(queue = 'records')
+    batcher = RecordBatcher(pub.publish, codec = 'msgpack', linger = 0.005)
+    for record in records:
+        batcher.add(record)
+    batcher.close()
+    pub.close()
+
+On the consumer side, decode_message() (and so PoolCon and AsyncCon by
+default) turns a batch into an iterator over its records, so the handler
+loops over them:
+
+    def handler(records):
+        for record in records:
+            ...
+
+    con = PoolCon(queue = 'records', handler = batch_handler(handler))
+
+batch_handler() wraps async handlers for AsyncCon the same way.
+
+BatchMetrics counts records and batches on either side, with histograms of
+batch sizes and of the time records spend waiting for their batch, to help
+choose max_records, max_bytes and linger.
+"""
+__filename__ = 'amqp_envelope'
+
+import inspect
+import threading
+import time
+
+import pika
+
+from amqp_codecs import BatchCodec, COMPRESSIONS
+
+
+class Histogram(object):
+    """Counts of values in power-of-two buckets."""
+
+    def __init__(self):
+        self.counts = {}   # upper bound -> count
+
+    def record(self, value):
+        upper = 1 << max(0, int(value) - 1).bit_length()
+        self.counts[upper] = self.counts.get(upper, 0) + 1
+
+    def percentile(self, q):
+        """Return the upper bound of the bucket holding the q-th percentile.
+        """
+        total = sum(self.counts.values())
+        seen = 0
+        for upper in sorted(self.counts):
+            seen += self.counts[upper]
+            if seen >= q / 100.0 * total:
+                return upper
+        return None
+
+    def to_dict(self):
+        return dict((str(upper), count)
+            for upper, count in sorted(self.counts.items()))
+
+
+class BatchMetrics(object):
+    """Per-record and per-batch counts, shared by the threads that record.
+
+    Attributes:
+        batches, records, bytes: totals so far
+        flushes: dict of reason -> batches sent for that reason, one of
+            'records', 'bytes', 'linger' or 'flush' (publisher only)
+        batch_records: Histogram of records per batch
+        batch_bytes: Histogram of encoded bytes per batch (publisher only)
+        record_wait_us: Histogram of microseconds each record waited for
+            its batch to be sent (publisher), or for its batch's handler to
+            reach it (consumer)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.records = 0
+        self.bytes = 0
+        self.flushes = {}
+        self.batch_records = Histogram()
+        self.batch_bytes = Histogram()
+        self.record_wait_us = Histogram()
+
+    def record_batch(self, records, size = None, waits = (), reason = None):
+        with self.lock:
+            self.batches += 1
+            self.records += records
+            self.batch_records.record(records)
+            if size is not None:
+                self.bytes += size
+                self.batch_bytes.record(size)
+            for wait in waits:
+                self.record_wait_us.record(wait * 1e6)
+            if reason is not None:
+                self.flushes[reason] = self.flushes.get(reason, 0) + 1
+
+    def to_dict(self):
+        with self.lock:
+            return {'batches': self.batches, 'records': self.records,
+                'bytes': self.bytes, 'flushes': dict(self.flushes),
+                'records_per_batch': self.records / float(self.batches)
+                    if self.batches else None,
+                'batch_records': self.batch_records.to_dict(),
+                'batch_bytes': self.batch_bytes.to_dict(),
+                'record_wait_us': self.record_wait_us.to_dict()}
+
+
+class RecordBatcher(object):
+
+    def __init__(self, send, codec = 'json', max_records = 1000,
+                 max_bytes = 65536, linger = 0.005, compression = None,
+                 threshold = 1024, metrics = None):
+        """Set up a batcher.
+
+        Args:
+            send: function called with (body, properties) for each batch,
+                e.g. BatchPub.publish. It is called from the thread that
+                adds the record completing a batch, or from a background
+                thread for batches sent after linger seconds. If it raises,
+                the batch is kept to be sent again, and the error is raised
+                to the caller (by the next add(), flush() or close() if it
+                was raised in the background thread).
+            codec: codec of each record (see amqp_codecs.py)
+            max_records: most records per batch
+            max_bytes: most encoded bytes per batch, before compression. A
+                single larger record is sent in a batch of its own.
+            linger: most seconds a record waits for its batch to fill up
+            compression: None, or a name from amqp_codecs.COMPRESSIONS, to
+                compress batches of at least threshold bytes
+            metrics: BatchMetrics to record to (default: a new one)
+        """
+        self.send = send
+        self.codec = BatchCodec(codec)
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.linger = linger
+        self.compression = compression
+        self.threshold = threshold
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError('unknown or unavailable compression {0!r}'.format(
+                compression))
+        self.metrics = metrics if metrics is not None else BatchMetrics()
+
+        # _cond guards the batch being collected; _send_lock keeps batches
+        # in order when the caller and the linger thread both send
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._encoded = []    # encoded records of the current batch
+        self._times = []      # time each record was added
+        self._bytes = 0       # framed size of the current batch
+        self._error = None    # raised by send in the linger thread
+        self._closed = False
+        self._thread = threading.Thread(target = self._linger_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, record):
+        """Add a record, sending the batch if it is full.
+
+        Once the record is encoded, it is always added, even if add() then
+        raises an error from sending this batch or an earlier one: the
+        failed batch is kept and sent again later, so the caller should not
+        add the record again.
+        """
+        encoded = self.codec.codec.encode(record)
+        size = len(encoded) + 4   # with its length prefix
+        with self._cond:
+            if self._closed:
+                raise ValueError('RecordBatcher is closed')
+            over = bool(self._encoded) \
+                and self._bytes + size > self.max_bytes
+            if not over:
+                full = self._append(encoded, size)
+        if over:
+            # Send the batch without this record, which starts the next one
+            try:
+                self._flush('bytes')
+            finally:
+                with self._cond:
+                    full = self._append(encoded, size)
+        if full:
+            self._flush('records')
+        self._raise_error()
+
+    def flush(self):
+        """Send the current batch now, if it has any records."""
+        self._raise_error()
+        self._flush('flush')
+
+    def close(self):
+        """Send the last batch and stop the linger thread."""
+        self._raise_error()
+        self._flush('flush')
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _flush(self, reason):
+        with self._send_lock:
+            with self._cond:
+                encoded, self._encoded = self._encoded, []
+                times, self._times = self._times, []
+                self._bytes = 0
+            if not encoded:
+                return
+            body = self.codec.frame(encoded)
+            size = len(body)
+            content_encoding = None
+            if self.compression is not None and size >= self.threshold:
+                body = COMPRESSIONS[self.compression][0](body)
+                content_encoding = self.compression
+            try:
+                self.send(body, pika.BasicProperties(
+                    content_type = self.codec.content_type,
+                    content_encoding = content_encoding))
+            except Exception:
+                # Put the batch back, ahead of any newer records
+                with self._cond:
+                    self._encoded[:0] = encoded
+                    self._times[:0] = times
+                    self._bytes += sum(len(record) + 4 for record in encoded)
+                raise
+            now = time.time()
+            self.metrics.record_batch(len(encoded), size,
+                [now - t for t in times], reason)
+
+    def _append(self, encoded, size):
+        # Called with _cond held. Returns whether the batch is full.
+        if not self._encoded:
+            self._cond.notify()   # start the linger clock
+        self._encoded.append(encoded)
+        self._times.append(time.time())
+        self._bytes += size
+        return len(self._encoded) >= self.max_records
+
+    def _raise_error(self):
+        with self._cond:
+            error, self._error = self._error, None
+            self._cond.notify()   # let the linger thread carry on
+        if error is not None:
+            raise error
+
+    def _linger_loop(self):
+        while True:
+            with self._cond:
+                # After a failed send, wait until the caller has seen the
+                # error rather than retrying in a loop
+                while (not self._encoded or self._error is not None) \
+                        and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                remaining = self._times[0] + self.linger - time.time()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+            try:
+                self._flush('linger')
+            except Exception as error:
+                with self._cond:
+                    self._error = error
+
+
+def batch_handler(handler, metrics = None):
+    """Wrap a handler of record iterators to record consumer metrics.
+
+    The wrapped handler is called with an iterator over the records of a
+    batch, which counts them as the handler takes them. If handler is a
+    coroutine function, as for AsyncCon, so is the returned function. It
+    has the BatchMetrics as its metrics attribute.
+    """
+    metrics = metrics if metrics is not None else BatchMetrics()
+
+    def counting(records, waits, start):
+        for record in records:
+            waits.append(time.time() - start)
+            yield record
+
+    if inspect.iscoroutinefunction(handler):
+        async def counted(records):
+            waits = []   # one per record taken
+            try:
+                return await handler(counting(records, waits, time.time()))
+            finally:
+                metrics.record_batch(len(waits), waits = waits)
+    else:
+        def counted(records):
+            waits = []   # one per record taken
+            try:
+                return handler(counting(records, waits, time.time()))
+            finally:
+                metrics.record_batch(len(waits), waits = waits)
+
+    counted.metrics = metrics
+    return counted
@@ -0,0 +1,246 @@
+"""AMQP consumer that handles messages in a worker pool.
+
+Con in amqp_consumer.py consumes with no_ack=True and handles each message
+in its callback, in the connection's thread, so one slow handler stalls the
+whole queue and messages being handled are lost if the consumer dies.
+PoolCon instead:
+
+- decodes and handles messages in a thread pool (or any
+  concurrent.futures executor, e.g. a ProcessPoolExecutor for CPU-bound
+  handlers), while the connection's thread only moves messages around
+- acknowledges a message only after its handler has finished, so the broker
+  delivers it again if the consumer dies first
+- acknowledges finished messages in batches with multiple=True, one frame
+  for many messages
+- sets basic_qos(prefetch_count), so the broker never sends more than that
+  many unacknowledged messages. When the pool is saturated, acks stop, the
+  prefetch window fills and the broker holds back the rest of the queue.
+
+    def handler(items):
+        for item in items:
+            print(item)
+
+    app = PoolCon(queue = 'hello2', handler = handler, workers = 8)
+    app.receive_messages()
+
+Messages whose handler raises are rejected: requeued the first time, and
+dropped (or dead-lettered, if the queue has a dead letter exchange) when
+they fail again on redelivery.
+"""
+__filename__ = 'amqp_pool_consumer'
+
+import collections
+import concurrent.futures
+import time
+
+import pika
+
+from amqp_codecs import decode_message
+
+
+class PoolCon(object):
+
+    def __init__(self, queue = 'hello1', handler = None, parameters = None,
+                 prefetch_count = 100, workers = 4, executor = None,
+                 decoder = None, ack_batch = None, ack_interval = 0.05,
+                 reconnect_delay = 1.0,
+                 connection_class = pika.SelectConnection):
+        """Set up the consumer; call receive_messages() to start.
+
+        Args:
+            queue: name of the queue to consume from
+            handler: function called in the pool with each decoded message
+            parameters: pika.ConnectionParameters (default: localhost)
+            prefetch_count: most unacknowledged messages the broker sends
+            workers: number of threads, if executor is not given
+            executor: concurrent.futures executor to run handlers in
+            decoder: function turning a message body into handler input,
+                also run in the pool. By default, bodies are decoded with
+                the codec named in their content_type (see amqp_codecs.py).
+            ack_batch: finished messages acknowledged together (default:
+                a quarter of prefetch_count)
+            ack_interval: seconds after which finished messages are
+                acknowledged even if there are fewer than ack_batch
+            reconnect_delay: seconds to wait before reconnecting
+            connection_class: pika.SelectConnection, or a stand-in with the
+                same interface (see amqp_standin.py)
+        """
+        self.queue = queue
+        self.handler = handler
+        self.parameters = parameters or pika.ConnectionParameters('localhost')
+        self.prefetch_count = prefetch_count
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(
+            workers)
+        self.decoder = decoder
+        if ack_batch is None:
+            ack_batch = max(1, prefetch_count // 4)
+        if prefetch_count:
+            # A batch as large as the prefetch window would never fill up
+            ack_batch = min(ack_batch, max(1, prefetch_count // 2))
+        self.ack_batch = ack_batch
+        self.ack_interval = ack_interval
+        self.reconnect_delay = reconnect_delay
+        self.connection_class = connection_class
+
+        self.connection = None
+        self.channel = None
+        self.processed = 0
+        self.failed = 0
+        self.ack_frames = 0   # basic_ack calls, each for one or more messages
+        self.reconnects = 0
+
+        # Delivery tag -> redelivered flag, for messages of the current
+        # channel not acknowledged yet, in delivery order
+        self._outstanding = collections.OrderedDict()
+        self._finished = set()   # tags in _outstanding whose handler is done
+        self._consumer_tag = None
+        self._closing = False
+
+    def receive_messages(self):
+        """Consume until stop() is called, reconnecting when necessary."""
+        print('Listening for Messages')
+        while not self._closing:
+            self.connection = self.connection_class(self.parameters,
+                on_open_callback = self._on_connection_open,
+                on_open_error_callback = self._on_connection_error,
+                on_close_callback = self._on_connection_closed)
+            self.connection.ioloop.start()
+            if not self._closing:
+                self.reconnects += 1
+                time.sleep(self.reconnect_delay)
+        self.executor.shutdown()
+
+    def stop(self):
+        """Stop consuming, finish and acknowledge messages, and disconnect.
+
+        Can be called from any thread.
+        """
+        self._closing = True
+        connection = self.connection
+        if connection is not None:
+            connection.ioloop.add_callback_threadsafe(self._stop_consuming)
+
+    # The rest runs in the connection's thread
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback = self._on_channel_open)
+
+    def _on_connection_error(self, connection, error):
+        connection.ioloop.stop()  # receive_messages reconnects
+
+    def _on_connection_closed(self, connection, reason):
+        self.channel = None
+        connection.ioloop.stop()  # receive_messages reconnects unless closing
+
+    def _on_channel_open(self, channel):
+        # Messages of an earlier channel are redelivered by the broker
+        self._outstanding.clear()
+        self._finished.clear()
+        self.channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.basic_qos(prefetch_count = self.prefetch_count,
+            callback = lambda frame: channel.queue_declare(queue = self.queue,
+                callback = self._on_queue_declared))
+
+    def _on_channel_closed(self, channel, reason):
+        self.channel = None
+        if self.connection.is_open:
+            self.connection.close()
+
+    def _on_queue_declared(self, frame):
+        if self._closing:
+            self.connection.close()
+            return
+        self._consumer_tag = self.channel.basic_consume(self.queue,
+            self._on_message)
+        self._on_timer()
+
+    def _stop_consuming(self):
+        if self.channel is not None and self._consumer_tag is not None:
+            self.channel.basic_cancel(self._consumer_tag)
+            self._consumer_tag = None
+            self._close_when_done()
+        elif self.connection.is_open:
+            self.connection.close()
+        else:
+            self.connection.ioloop.stop()
+
+    def _close_when_done(self):
+        if self._closing and not self._outstanding \
+                and self.connection.is_open:
+            self.connection.close()
+
+    def _on_timer(self):
+        if self.channel is None:
+            return
+        self._ack(force = True)
+        self.connection.ioloop.call_later(self.ack_interval, self._on_timer)
+
+    def _on_message(self, channel, method, properties, body):
+        tag = method.delivery_tag
+        self._outstanding[tag] = method.redelivered
+        future = self.executor.submit(_handle, self.handler, self.decoder,
+            body, properties)
+        ioloop = self.connection.ioloop
+        future.add_done_callback(lambda f: ioloop.add_callback_threadsafe(
+            lambda: self._on_done(channel, tag, f)))
+
+    def _on_done(self, channel, tag, future):
+        if channel is not self.channel or not channel.is_open:
+            return  # the broker has already requeued it
+        if future.exception() is None:
+            self.processed += 1
+            self._finished.add(tag)
+            self._ack()
+        else:
+            self.failed += 1
+            redelivered = self._outstanding.pop(tag)
+            channel.basic_nack(tag, requeue = not redelivered)
+        self._close_when_done()
+
+    def _ack(self, force = False):
+        """Acknowledge finished messages.
+
+        Acks with multiple=True cover every earlier delivery tag, so they can
+        only be used for a run of finished messages at the front of
+        _outstanding. That run is acknowledged once it holds ack_batch
+        messages. With force, it is acknowledged whatever its size, and
+        finished messages behind a slow one are acknowledged one by one.
+        """
+        run = []
+        for tag in self._outstanding:
+            if tag not in self._finished:
+                break
+            run.append(tag)
+        if run and (force or len(run) >= self.ack_batch
+                or len(run) == len(self._outstanding)):
+            self.channel.basic_ack(run[-1], multiple = True)
+            self.ack_frames += 1
+            for tag in run:
+                del self._outstanding[tag]
+                self._finished.discard(tag)
+        if force:
+            for tag in sorted(self._finished):
+                self.channel.basic_ack(tag)
+                self.ack_frames += 1
+                del self._outstanding[tag]
+            self._finished.clear()
+
+
+def _handle(handler, decoder, body, properties):
+    # Module-level, so it can be sent to a ProcessPoolExecutor
+    if decoder is None:
+        return handler(decode_message(body, properties))
+    return handler(decoder(body))
+
+
+if __name__ == '__main__':
+    def demo2(this_list):
+        for item in this_list:
+            print(item)
+
+    app = PoolCon(queue = 'hello2', handler = demo2)
+    try:
+        app.receive_messages()
+    except KeyboardInterrupt:
+        pass
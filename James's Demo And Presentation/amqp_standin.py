@@ -0,0 +1,354 @@
+"""In-process stand-in for a RabbitMQ broker, for benchmarks and tests.
+
+StandInConnection takes the same arguments and callbacks as
+pika.SelectConnection and supports the channel methods the publishers and
+consumers in this directory use, so they can run without a server:
+
+    broker = StandInBroker(latency = 0.001)
+    factory = functools.partial(StandInConnection, broker = broker)
+    pub = BatchPub(queue = 'hello1', connection_class = factory)
+
+Passing an asyncio event loop as custom_ioloop, as for
+pika.adapters.asyncio_connection.AsyncioConnection, runs the connection's
+callbacks on that loop instead.
+
+Every request that needs a reply from a real broker (opening a connection
+or channel, declaring a queue, confirming a publish) gets its reply after
+latency seconds, to model the network round trip. Publisher confirms are
+sent in batches with multiple=True, as RabbitMQ does under load. Consumers
+get at most prefetch_count unacknowledged messages, and messages that are
+nacked, or unacknowledged when their channel closes, are queued again.
+"""
+__filename__ = 'amqp_standin'
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+import pika
+import pika.exceptions
+import pika.frame
+import pika.spec
+
+
+class StandInIOLoop(object):
+    """Callback loop with the parts of the pika IOLoop interface we use."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._callbacks = collections.deque()
+        self._timers = []  # heap of [due time, sequence number, callback]
+        self._sequence = itertools.count()
+        self._running = False
+
+    def add_callback_threadsafe(self, callback):
+        with self._cond:
+            self._callbacks.append(callback)
+            self._cond.notify()
+
+    def call_later(self, delay, callback):
+        timer = [time.time() + delay, next(self._sequence), callback]
+        with self._cond:
+            heapq.heappush(self._timers, timer)
+            self._cond.notify()
+        return timer
+
+    def remove_timeout(self, timer):
+        timer[2] = None  # skipped when it comes due
+
+    def start(self):
+        self._running = True
+        while self._running:
+            with self._cond:
+                while not self._callbacks:
+                    now = time.time()
+                    if self._timers and self._timers[0][0] <= now:
+                        self._callbacks.append(heapq.heappop(self._timers)[2])
+                    elif self._timers:
+                        self._cond.wait(self._timers[0][0] - now)
+                    else:
+                        self._cond.wait()
+                callback = self._callbacks.popleft()
+            if callback is not None:
+                callback()
+
+    def stop(self):
+        def stop():
+            self._running = False
+        self.add_callback_threadsafe(stop)
+
+
+class AsyncioIOLoop(object):
+    """The same interface as StandInIOLoop, on an asyncio event loop."""
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def add_callback_threadsafe(self, callback):
+        self.loop.call_soon_threadsafe(callback)
+
+    def call_later(self, delay, callback):
+        return self.loop.call_later(delay, callback)
+
+    def remove_timeout(self, timer):
+        timer.cancel()
+
+
+class StandInBroker(object):
+    """Message queues shared by the stand-in connections.
+
+    Each queue holds (properties, body, redelivered) tuples.
+    """
+
+    def __init__(self, latency = 0.0):
+        self.latency = latency
+        self.queues = collections.defaultdict(collections.deque)
+        self.consumers = collections.defaultdict(list)  # queue -> channels
+        self.published = 0
+        self.acked = 0
+        self.requeued = 0
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def _put(self, queue, messages, front = False):
+        """Add messages to a queue and tell its consumers."""
+        with self.lock:
+            if front:
+                self.queues[queue].extendleft(reversed(messages))
+            else:
+                self.queues[queue].extend(messages)
+            consumers = list(self.consumers[queue])
+        for channel in consumers:
+            channel.connection.ioloop.add_callback_threadsafe(channel._deliver)
+
+    def disconnect_all(self):
+        """Drop every connection, as if the broker had restarted."""
+        for connection in list(self.connections):
+            connection.ioloop.add_callback_threadsafe(lambda c = connection:
+                c._closed(pika.exceptions.ConnectionClosedByBroker(320,
+                    'CONNECTION_FORCED - stand-in broker restart')))
+
+
+class StandInConnection(object):
+    """Stand-in for pika.SelectConnection, connected to a StandInBroker.
+
+    With an asyncio event loop as custom_ioloop, it stands in for
+    AsyncioConnection.
+    """
+
+    def __init__(self, parameters = None, on_open_callback = None,
+                 on_open_error_callback = None, on_close_callback = None,
+                 custom_ioloop = None, broker = None):
+        self.broker = broker if broker is not None else StandInBroker()
+        self.ioloop = StandInIOLoop() if custom_ioloop is None \
+            else AsyncioIOLoop(custom_ioloop)
+        self.is_open = False
+        self.is_closed = False
+        self._on_close_callback = on_close_callback
+        self._channels = []
+        with self.broker.lock:
+            self.broker.connections.append(self)
+
+        def opened():
+            self.is_open = True
+            if on_open_callback is not None:
+                on_open_callback(self)
+        self.ioloop.call_later(self.broker.latency, opened)
+
+    def channel(self, on_open_callback = None):
+        channel = StandInChannel(self, len(self._channels) + 1)
+        self._channels.append(channel)
+
+        def opened():
+            channel.is_open = True
+            if on_open_callback is not None:
+                on_open_callback(channel)
+        self.ioloop.call_later(self.broker.latency, opened)
+        return channel
+
+    def close(self, reply_code = 200, reply_text = 'Normal shutdown'):
+        self.ioloop.call_later(self.broker.latency, lambda: self._closed(
+            pika.exceptions.ConnectionClosedByClient(reply_code, reply_text)))
+
+    def _closed(self, reason):
+        if self.is_closed:
+            return
+        self.is_open = False
+        self.is_closed = True
+        with self.broker.lock:
+            self.broker.connections.remove(self)
+        for channel in self._channels:
+            channel._closed(reason)
+        if self._on_close_callback is not None:
+            self._on_close_callback(self, reason)
+
+
+class StandInChannel(object):
+    """Stand-in for pika.channel.Channel."""
+
+    def __init__(self, connection, channel_number):
+        self.connection = connection
+        self.channel_number = channel_number
+        self.is_open = False
+        self._on_close_callbacks = []
+        self._on_ack_nack = None
+        self._delivery_tag = 0   # of the last message published
+        self._acked_tag = 0      # of the last message confirmed
+        self._ack_timer = None
+        self._prefetch_count = 0   # 0 is unlimited
+        self._consumer = None      # (queue, callback, auto_ack, tag)
+        self._unacked = collections.OrderedDict()  # tag -> (queue, message)
+        self._consume_tag = 0      # of the last message delivered
+
+    def _reply(self, callback, method):
+        if callback is not None:
+            frame = pika.frame.Method(self.channel_number, method)
+            self.connection.ioloop.call_later(
+                self.connection.broker.latency, lambda: callback(frame))
+
+    def add_on_close_callback(self, callback):
+        self._on_close_callbacks.append(callback)
+
+    def confirm_delivery(self, ack_nack_callback, callback = None):
+        self._on_ack_nack = ack_nack_callback
+        self._reply(callback, pika.spec.Confirm.SelectOk())
+
+    def queue_declare(self, queue, passive = False, durable = False,
+                      exclusive = False, auto_delete = False,
+                      arguments = None, callback = None):
+        broker = self.connection.broker
+        with broker.lock:
+            count = len(broker.queues[queue])
+        self._reply(callback, pika.spec.Queue.DeclareOk(queue, count, 0))
+
+    def basic_publish(self, exchange, routing_key, body, properties = None,
+                      mandatory = False):
+        if not self.is_open:
+            raise pika.exceptions.ChannelWrongStateError('Channel is closed.')
+        broker = self.connection.broker
+        with broker.lock:
+            broker.published += 1
+        broker._put(routing_key, [(properties, body, False)])
+        if self._on_ack_nack is not None:
+            self._delivery_tag += 1
+            if self._ack_timer is None:
+                self._ack_timer = self.connection.ioloop.call_later(
+                    broker.latency, self._send_ack)
+
+    def _send_ack(self):
+        # Confirm everything published so far with one multiple ack
+        self._ack_timer = None
+        if self.is_open and self._delivery_tag > self._acked_tag:
+            self._acked_tag = self._delivery_tag
+            self._on_ack_nack(pika.frame.Method(self.channel_number,
+                pika.spec.Basic.Ack(self._acked_tag, multiple = True)))
+
+    def basic_qos(self, prefetch_size = 0, prefetch_count = 0,
+                  global_qos = False, callback = None):
+        self._prefetch_count = prefetch_count
+        self._reply(callback, pika.spec.Basic.QosOk())
+
+    def basic_consume(self, queue, on_message_callback, auto_ack = False,
+                      exclusive = False, consumer_tag = None,
+                      arguments = None, callback = None):
+        consumer_tag = consumer_tag or 'ctag{0}.{1}'.format(
+            self.channel_number, id(self))
+        self._consumer = (queue, on_message_callback, auto_ack, consumer_tag)
+        broker = self.connection.broker
+        with broker.lock:
+            broker.consumers[queue].append(self)
+        self._reply(callback, pika.spec.Basic.ConsumeOk(consumer_tag))
+        self.connection.ioloop.call_later(broker.latency, self._deliver)
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag = '', callback = None):
+        self._stop_consuming()
+        self._reply(callback, pika.spec.Basic.CancelOk(consumer_tag))
+
+    def _stop_consuming(self):
+        if self._consumer is not None:
+            broker = self.connection.broker
+            with broker.lock:
+                broker.consumers[self._consumer[0]].remove(self)
+            self._consumer = None
+
+    def _deliver(self):
+        broker = self.connection.broker
+        while self.is_open and self._consumer is not None:
+            queue, on_message, auto_ack, consumer_tag = self._consumer
+            if not auto_ack and self._prefetch_count \
+                    and len(self._unacked) >= self._prefetch_count:
+                return
+            with broker.lock:
+                if not broker.queues[queue]:
+                    return
+                message = broker.queues[queue].popleft()
+            self._consume_tag += 1
+            if not auto_ack:
+                self._unacked[self._consume_tag] = (queue, message)
+            properties, body, redelivered = message
+            on_message(self, pika.spec.Basic.Deliver(consumer_tag,
+                    self._consume_tag, redelivered, '', queue),
+                properties or pika.spec.BasicProperties(), body)
+
+    def basic_ack(self, delivery_tag = 0, multiple = False):
+        self.connection.ioloop.call_later(self.connection.broker.latency,
+            lambda: self._settle(delivery_tag, multiple, None))
+
+    def basic_nack(self, delivery_tag = 0, multiple = False, requeue = True):
+        self.connection.ioloop.call_later(self.connection.broker.latency,
+            lambda: self._settle(delivery_tag, multiple, requeue))
+
+    def _settle(self, delivery_tag, multiple, requeue):
+        """Handle an ack (requeue None) or a nack when it reaches the broker.
+        """
+        if not self.is_open:
+            return
+        if delivery_tag not in self._unacked:
+            # Like RabbitMQ, close the channel on an unknown delivery tag
+            self._closed(pika.exceptions.ChannelClosedByBroker(406,
+                'PRECONDITION_FAILED - unknown delivery tag {0}'.format(
+                    delivery_tag)))
+            return
+        if multiple:
+            tags = [tag for tag in self._unacked if tag <= delivery_tag]
+        else:
+            tags = [delivery_tag]
+        settled = [self._unacked.pop(tag) for tag in tags]
+        broker = self.connection.broker
+        if requeue:
+            self._requeue(settled)
+        else:
+            with broker.lock:
+                broker.acked += len(settled)
+        self._deliver()
+
+    def _requeue(self, settled):
+        # Back to the front of their queues, oldest first
+        broker = self.connection.broker
+        with broker.lock:
+            broker.requeued += len(settled)
+        for queue in set(queue for queue, message in settled):
+            broker._put(queue, [(properties, body, True)
+                for q, (properties, body, redelivered) in settled
+                if q == queue], front = True)
+
+    def close(self, reply_code = 0, reply_text = 'Normal shutdown'):
+        self.connection.ioloop.add_callback_threadsafe(lambda: self._closed(
+            pika.exceptions.ChannelClosedByClient(reply_code, reply_text)))
+
+    def _closed(self, reason):
+        if not self.is_open:
+            return
+        self.is_open = False
+        if self._ack_timer is not None:
+            self.connection.ioloop.remove_timeout(self._ack_timer)
+            self._ack_timer = None
+        self._stop_consuming()
+        unacked = list(self._unacked.values())
+        self._unacked.clear()
+        self._requeue(unacked)
+        for callback in self._on_close_callbacks:
+            callback(self, reason)